@@ -0,0 +1,336 @@
+"""Run a cluster of EmailBlockchain nodes on loopback and measure block propagation and delivery.
+
+Every link between two nodes goes through a proxy that can add latency,
+jitter and frame loss. Nodes run in this process's event loop, or one
+process each with --processes.
+
+Run from the repository root:
+    python -m benchmarks.cluster_benchmark --nodes 5 --rate 5 --duration 20
+    python -m benchmarks.cluster_benchmark --nodes 8 --degree 3 --latency 0.05 --loss 0.01 --processes
+"""
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from cryptography.hazmat.primitives import serialization
+
+from blockchain import EmailBlockchain, Wallet
+from network.framing import FRAME_HEADER
+
+HOST = '127.0.0.1'
+
+
+class LinkProxy:
+    """TCP proxy in front of one node for one neighbour, with shaped delivery.
+
+    Frames are forwarded whole, so a dropped frame looks like a lost message
+    to the nodes rather than a corrupt stream. Release times never go
+    backwards, so jitter delays frames without reordering them.
+    """
+
+    def __init__(self, port: int, target_port: int, latency: float = 0.0,
+                 jitter: float = 0.0, loss: float = 0.0, seed: int = 0):
+        self.port = port
+        self.target_port = target_port
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.forwarded = 0
+        self.dropped = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, HOST, self.port)
+
+    async def _handle(self, reader, writer):
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(HOST, self.target_port)
+        except OSError:
+            writer.close()
+            return
+        try:
+            await asyncio.gather(self._pipe(reader, upstream_writer),
+                                 self._pipe(upstream_reader, writer))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            writer.close()
+            upstream_writer.close()
+
+    async def _pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                release_at, frame = await queue.get()
+                if frame is None:
+                    return
+                delay = release_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(frame)
+                await writer.drain()
+
+        sender = asyncio.create_task(deliver())
+        last_release = 0.0
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                frame = header + await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                if self.rng.random() < self.loss:
+                    self.dropped += 1
+                    continue
+                last_release = max(last_release, loop.time() + self.latency +
+                                   self.rng.uniform(0, self.jitter))
+                queue.put_nowait((last_release, frame))
+                self.forwarded += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            queue.put_nowait((0.0, None))
+            with contextlib.suppress(ConnectionError):
+                await sender
+            writer.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+def build_topology(nodes: int, degree: int, seed: int):
+    """Ring plus random chords until the average degree is reached; returns undirected edges."""
+    rng = random.Random(seed)
+    edges = {tuple(sorted((i, (i + 1) % nodes))) for i in range(nodes)} if nodes > 1 else set()
+    possible = nodes * (nodes - 1) // 2
+    while len(edges) < min(possible, nodes * degree // 2):
+        a, b = rng.sample(range(nodes), 2)
+        edges.add((min(a, b), max(a, b)))
+    return sorted(edges)
+
+
+def make_wallets(count: int):
+    """(address, PEM public key) per node; only addresses matter for delivery."""
+    wallets = []
+    for _ in range(count):
+        wallet = Wallet()
+        wallets.append((wallet.address, wallet.public_key.public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)))
+    return wallets
+
+
+def create_node(index: int, config: dict, wallets, emit) -> EmailBlockchain:
+    """Build node index and report its appends and deliveries through emit(event)."""
+    node = EmailBlockchain(HOST, config['base_port'] + index,
+                           os.path.join(config['data_root'], f'node{index}'),
+                           seed_peers=[(HOST, port) for port in config['links'][index]],
+                           difficulty_bits=config['difficulty'], smtp_port=None,
+                           mining_workers=1, discover_peers=False)
+    for address, public_key in wallets:
+        node.wallet_resolver.register_wallet(address, public_key)
+    own_address = wallets[index][0]
+    partial = {}  # message id -> chunk ids seen so far
+
+    def on_block(height, block):
+        now = time.time()
+        emit(('block', block.hash, index, now))
+        for chunk in block.email_chunks:
+            if chunk.recipient_address != own_address:
+                continue
+            seen = partial.setdefault(chunk.message_id, set())
+            seen.add(chunk.chunk_id)
+            if len(seen) == chunk.total_chunks:
+                del partial[chunk.message_id]
+                emit(('delivered', chunk.message_id, index, now))
+
+    node.blockchain.subscribe(on_block)
+    return node
+
+
+async def wait_connected(node: EmailBlockchain, timeout: float = 30.0):
+    await asyncio.wait_for(asyncio.gather(
+        *(connection.connected.wait() for connection in node.node.connections.values())), timeout)
+
+
+async def inject_load(nodes: dict, wallets, rate: float, duration: float, size: int,
+                      rng: random.Random, emit):
+    """Send emails from the given nodes as a Poisson process of rate per second."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    senders = list(nodes)
+    while True:
+        await asyncio.sleep(rng.expovariate(rate))
+        if loop.time() >= deadline:
+            return
+        index = rng.choice(senders)
+        recipient = rng.choice([address for i, (address, _) in enumerate(wallets) if i != index])
+        message_id = nodes[index].protocol.send_email(None, recipient, os.urandom(size))
+        emit(('sent', message_id, index, time.time()))
+
+
+def final_event(index: int, node: EmailBlockchain):
+    frames = sum(stats['sent_frames'] for stats in node.node.peer_stats().values())
+    return ('final', node.blockchain.chain[-1].hash, index, frames)
+
+
+def node_process(index: int, config: dict, wallets, events, go):
+    asyncio.run(run_node_process(index, config, wallets, events, go))
+
+
+async def run_node_process(index: int, config: dict, wallets, events, go):
+    with quiet(config['verbose']):
+        node = create_node(index, config, wallets, events.put)
+        await node.start()
+        await wait_connected(node)
+        events.put(('ready', None, index, time.time()))
+        await asyncio.get_running_loop().run_in_executor(None, go.wait)
+        await inject_load({index: node}, wallets, config['rate'] / config['nodes'], config['duration'],
+                          config['size'], random.Random(config['seed'] + index), events.put)
+        await asyncio.sleep(config['settle'])
+        events.put(final_event(index, node))
+        node.stop()
+
+
+def quiet(verbose: bool):
+    # The nodes log every block they mine and every connection they make.
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+
+async def run_cluster(config: dict, processes: bool):
+    edges = build_topology(config['nodes'], config['degree'], config['seed'])
+    proxies, links = [], {i: [] for i in range(config['nodes'])}
+    port = config['base_port'] + config['nodes']
+    for a, b in edges:
+        for source, target in ((a, b), (b, a)):
+            proxies.append(LinkProxy(port, config['base_port'] + target, config['latency'],
+                                     config['jitter'], config['loss'], config['seed'] + port))
+            links[source].append(port)
+            port += 1
+    config['links'] = links
+    for proxy in proxies:
+        await proxy.start()
+
+    wallets = make_wallets(config['nodes'])
+    events = []
+    if processes:
+        events, start, end = await run_processes(config, wallets)
+    else:
+        with quiet(config['verbose']):
+            nodes = {i: create_node(i, config, wallets, events.append) for i in range(config['nodes'])}
+            for node in nodes.values():
+                await node.start()
+            await asyncio.gather(*(wait_connected(node) for node in nodes.values()))
+            start = time.time()
+            await inject_load(nodes, wallets, config['rate'], config['duration'], config['size'],
+                              random.Random(config['seed']), events.append)
+            await asyncio.sleep(config['settle'])
+            end = time.time()
+            events.extend(final_event(i, node) for i, node in nodes.items())
+            for node in nodes.values():
+                node.stop()
+
+    for proxy in proxies:
+        proxy.close()
+    return events, end - start, proxies
+
+
+async def run_processes(config: dict, wallets):
+    context = multiprocessing.get_context('spawn')
+    queue, go = context.Queue(), context.Event()
+    workers = [context.Process(target=node_process, args=(i, config, wallets, queue, go))
+               for i in range(config['nodes'])]
+    for worker in workers:
+        worker.start()
+    loop = asyncio.get_running_loop()
+    events, ready, finished, start, end = [], 0, 0, time.time(), time.time()
+    while finished < len(workers):
+        event = await loop.run_in_executor(None, queue.get)
+        if event[0] == 'ready':
+            ready += 1
+            if ready == len(workers):
+                start = time.time()
+                go.set()
+            continue
+        if event[0] == 'final':
+            finished += 1
+            end = time.time()
+        events.append(event)
+    for worker in workers:
+        worker.join()
+    return events, start, end
+
+
+def percentiles(samples) -> str:
+    if len(samples) < 2:
+        return "n/a"
+    cuts = statistics.quantiles(samples, n=100)
+    return f"p50 {cuts[49] * 1000:7.1f} ms | p90 {cuts[89] * 1000:7.1f} ms | p99 {cuts[98] * 1000:7.1f} ms"
+
+
+def report(events, elapsed: float, nodes: int, proxies):
+    first_seen, arrivals, sent, delivered, tips, frames = {}, {}, {}, {}, set(), 0
+    for kind, key, index, value in events:
+        if kind == 'block':
+            arrivals.setdefault(key, []).append(value)
+        elif kind == 'sent':
+            sent[key] = value
+        elif kind == 'delivered':
+            delivered[key] = value
+        elif kind == 'final':
+            tips.add(key)
+            frames += value
+    propagation = []
+    for key, times in arrivals.items():
+        first_seen[key] = min(times)
+        propagation.extend(t - first_seen[key] for t in times if t != first_seen[key])
+    latencies = [delivered[key] - sent[key] for key in delivered if key in sent]
+    fully_propagated = sum(len(times) == nodes for times in arrivals.values())
+
+    print(f"{nodes} nodes, {elapsed:.1f}s of load and settling")
+    print(f"blocks:      {len(arrivals)} ({fully_propagated} reached every node)")
+    print(f"propagation: {percentiles(propagation)}")
+    print(f"emails:      {len(sent)} sent, {len(latencies)} delivered "
+          f"({len(latencies) / elapsed:.1f}/s)")
+    print(f"delivery:    {percentiles(latencies)}")
+    print(f"messages:    {frames} frames sent ({frames / elapsed:.0f}/s), "
+          f"{sum(proxy.dropped for proxy in proxies)} dropped by links")
+    print(f"chain tips:  {len(tips)} distinct" + (" (nodes diverged)" if len(tips) > 1 else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, default=5)
+    parser.add_argument('--degree', type=int, default=2, help='average number of neighbours')
+    parser.add_argument('--rate', type=float, default=5.0, help='emails per second, whole cluster')
+    parser.add_argument('--size', type=int, default=4096, help='bytes per email')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load')
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to wait after the load stops')
+    parser.add_argument('--latency', type=float, default=0.0, help='one-way link delay, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random link delay, seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability a frame is dropped')
+    parser.add_argument('--difficulty', type=int, default=12, help='leading zero bits per block')
+    parser.add_argument('--base-port', type=int, default=19000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--processes', action='store_true', help='run each node in its own process')
+    parser.add_argument('--verbose', action='store_true', help='show node output')
+    args = parser.parse_args(argv)
+
+    data_root = tempfile.mkdtemp(prefix='chainmail-cluster-')
+    config = dict(vars(args), data_root=data_root)
+    try:
+        events, elapsed, proxies = asyncio.run(run_cluster(config, args.processes))
+    finally:
+        shutil.rmtree(data_root, ignore_errors=True)
+    report(events, elapsed, args.nodes, proxies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Compare nonce-search hash rates of the legacy and binary-header block hashing.
+
+Run from the repository root:
+    python -m benchmarks.header_hash_benchmark --chunks 100 --seconds 3
+"""
+import argparse
+import hashlib
+import os
+import time
+
+from blockchain import Block, EmailChunk, HEADER_NONCE
+
+
+def legacy_hash(block):
+    # The pre-header implementation: the repr of the chunk list plus the
+    # previous hash and nonce, re-stringified on every attempt.
+    sha = hashlib.sha256()
+    sha.update(str(block.email_chunks).encode('utf-8') +
+               str(block.previous_hash).encode('utf-8') +
+               str(block.nonce).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def legacy_rate(block, seconds: float) -> float:
+    attempts = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            block.nonce += 1
+            legacy_hash(block)
+        attempts += 1000
+    return attempts / (time.perf_counter() - start)
+
+
+def header_rate(block, seconds: float) -> float:
+    prefix = hashlib.sha256(block.header_prefix())
+    pack_nonce = HEADER_NONCE.pack
+    attempts = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(1000):
+            block.nonce += 1
+            sha = prefix.copy()
+            sha.update(pack_nonce(block.nonce))
+            sha.hexdigest()
+        attempts += 1000
+    return attempts / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=100, help='email chunks per block')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='bytes per chunk')
+    parser.add_argument('--seconds', type=float, default=3.0, help='duration of each run')
+    args = parser.parse_args(argv)
+
+    chunks = [EmailChunk(i, os.urandom(args.chunk_size), 'A' * 40) for i in range(args.chunks)]
+    block = Block(chunks, hashlib.sha256(b'previous').hexdigest())
+
+    legacy = legacy_rate(block, args.seconds)
+    block.nonce = 0
+    header = header_rate(block, args.seconds)
+
+    print(f"chunks per block: {args.chunks}")
+    print(f"legacy str() hashing:  {legacy:>14,.0f} hashes/sec")
+    print(f"binary header hashing: {header:>14,.0f} hashes/sec")
+    print(f"speedup:               {header / legacy:>14.1f}x")
+
+
+if __name__ == '__main__':
+    main()
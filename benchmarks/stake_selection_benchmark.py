@@ -0,0 +1,66 @@
+"""Compare linear-scan and Fenwick-tree stake-weighted validator selection.
+
+Run from the repository root:
+    python -m benchmarks.stake_selection_benchmark --stakers 100000 1000000
+"""
+import argparse
+import random
+import time
+
+from consensus.stake_registry import StakeRegistry
+
+
+def legacy_select(stakers: dict) -> str:
+    # The pre-registry ProofOfStake.select_validator: sum, then walk the dict.
+    total_stake = sum(stakers.values())
+    target = random.uniform(0, total_stake)
+    current_stake = 0
+    for address, stake in stakers.items():
+        current_stake += stake
+        if current_stake >= target:
+            return address
+    return list(stakers.keys())[0]
+
+
+def rate(function, seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def run(count: int, seconds: float):
+    rng = random.Random(count)
+    addresses = [f'{i:040d}' for i in range(count)]
+    stakes = [rng.uniform(1, 1000) for _ in range(count)]
+
+    start = time.perf_counter()
+    registry = StakeRegistry()
+    for address, stake in zip(addresses, stakes):
+        registry.add_stake(address, stake)
+    build = time.perf_counter() - start
+    stakers = dict(zip(addresses, stakes))
+
+    draw_rng = random.Random(42)
+    legacy = rate(lambda: legacy_select(stakers), seconds)
+    sample = rate(lambda: registry.sample(draw_rng), seconds)
+    update = rate(lambda: registry.add_stake(addresses[draw_rng.randrange(count)], 1.0), seconds)
+
+    print(f"{count:>9,} stakers: build {build:6.2f}s | "
+          f"linear select {legacy:>10,.1f}/s | fenwick select {sample:>10,.0f}/s | "
+          f"stake update {update:>10,.0f}/s | speedup {sample / legacy:,.0f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stakers', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    args = parser.parse_args(argv)
+    for count in args.stakers:
+        run(count, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
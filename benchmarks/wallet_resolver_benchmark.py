@@ -0,0 +1,109 @@
+"""Compare wallet lookups per second of the connect-per-call and pooled WAL resolvers.
+
+Also measures parsed-key lookups through get_key against parsing each key
+from its stored bytes.
+
+Run from the repository root:
+    python -m benchmarks.wallet_resolver_benchmark --wallets 100000 --threads 1 4
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from crypto.keys import load_public_key
+from wallet.resolver import WalletResolver
+
+
+def legacy_get_public_key(db_path: str, wallet_address: str):
+    # The pre-pool WalletResolver.get_public_key: a fresh connection per lookup.
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('SELECT public_key FROM wallet_mappings WHERE wallet_address = ?',
+              (wallet_address,))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+
+def lookups_per_second(lookup, addresses, threads: int, seconds: float) -> float:
+    def worker(seed):
+        rng = random.Random(seed)
+        count = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                lookup(rng.choice(addresses))
+            count += 100
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        total = sum(pool.map(worker, range(threads)))
+    return total / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wallets', type=int, default=100000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--batch', type=int, default=100, help='addresses per get_many call')
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    parser.add_argument('--hot', type=int, default=1000, help='distinct recipients in the get_key measurement')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='chainmail-wallets-')
+    try:
+        resolver = WalletResolver(os.path.join(directory, 'wallets.db'))
+        wallets = [(os.urandom(32).hex(), os.urandom(294)) for _ in range(args.wallets)]
+        start = time.perf_counter()
+        resolver.register_many(wallets)
+        print(f"register_many: {args.wallets / (time.perf_counter() - start):,.0f} wallets/s")
+        addresses = [address for address, _ in wallets]
+
+        batch_rng = random.Random(0)
+        start, looked_up = time.perf_counter(), 0
+        while time.perf_counter() - start < args.seconds:
+            resolver.get_many(batch_rng.sample(addresses, args.batch))
+            looked_up += args.batch
+        print(f"get_many ({args.batch} per call): {looked_up / (time.perf_counter() - start):,.0f} lookups/s")
+
+        for threads in args.threads:
+            legacy = lookups_per_second(lambda a: legacy_get_public_key(resolver.db_path, a),
+                                        addresses, threads, args.seconds)
+            pooled = lookups_per_second(resolver.get_public_key, addresses, threads, args.seconds)
+            print(f"{threads} thread(s): connect per call {legacy:>10,.0f}/s | "
+                  f"pooled {pooled:>10,.0f}/s | speedup {pooled / legacy:.1f}x")
+
+        # Real keys for a hot set of recipients, half of lookups to unknown addresses.
+        public_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+        pem = public_key.public_bytes(encoding=serialization.Encoding.PEM,
+                                      format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        hot = [os.urandom(32).hex() for _ in range(args.hot)]
+        resolver.register_many((address, pem) for address in hot)
+        mixed = hot + [os.urandom(32).hex() for _ in range(args.hot)]
+
+        def parse_every_time(address):
+            key_data = resolver.get_public_key(address)
+            return load_public_key(key_data) if key_data is not None else None
+
+        for threads in args.threads:
+            uncached = lookups_per_second(parse_every_time, mixed, threads, args.seconds)
+            cached = lookups_per_second(resolver.get_key, mixed, threads, args.seconds)
+            print(f"{threads} thread(s): parse per lookup {uncached:>10,.0f}/s | "
+                  f"get_key {cached:>10,.0f}/s | speedup {cached / uncached:.1f}x")
+        print(f"get_key cache: {resolver.cache_stats()}")
+        resolver.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compare JSON and binary block encodings for size, round-trip fidelity and throughput.
+
+Run from the repository root:
+    python -m benchmarks.wire_codec_benchmark --chunks 64 --chunk-size 16384
+"""
+import argparse
+import json
+import os
+import time
+
+from blockchain import Block, EmailChunk
+from network.codec import decode_block, encode_block
+
+
+def json_encode(block) -> bytes:
+    # The pre-codec wire and storage path.
+    return json.dumps(block.to_dict()).encode('utf-8')
+
+
+def json_decode(payload: bytes):
+    return Block.from_dict(json.loads(payload))
+
+
+def binary_decode(payload: bytes):
+    return decode_block(payload)[0]
+
+
+def make_block(chunks: int, chunk_size: int):
+    email_chunks = [EmailChunk(i, os.urandom(chunk_size), os.urandom(32).hex(),
+                               os.urandom(256), os.urandom(16).hex(), chunks)
+                    for i in range(chunks)]
+    block = Block(email_chunks, os.urandom(32).hex())
+    block.mine_block(8)
+    return block
+
+
+def same_block(a, b) -> bool:
+    return (a.hash == b.hash and a.previous_hash == b.previous_hash and
+            a.merkle_root == b.merkle_root and a.calculate_merkle_root() == b.merkle_root and
+            all(bytes(x.encrypted_content) == bytes(y.encrypted_content) and
+                bytes(x.envelope) == bytes(y.envelope) and
+                x.recipient_address == y.recipient_address and x.message_id == y.message_id
+                for x, y in zip(a.email_chunks, b.email_chunks)))
+
+
+def rate(function, seconds: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=64)
+    parser.add_argument('--chunk-size', type=int, default=16 * 1024)
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of each measurement')
+    args = parser.parse_args(argv)
+
+    block = make_block(args.chunks, args.chunk_size)
+    payload_bytes = args.chunks * args.chunk_size
+    print(f"Block of {args.chunks} chunks, {payload_bytes / 1e6:.2f} MB of ciphertext")
+
+    for name, encode, decode in (('json', json_encode, json_decode),
+                                 ('binary', encode_block, binary_decode)):
+        encoded = encode(block)
+        assert same_block(block, decode(encoded)), f"{name} round trip changed the block"
+        encode_rate = rate(lambda: encode(block), args.seconds)
+        decode_rate = rate(lambda: decode(encoded), args.seconds)
+        print(f"{name:>6}: {len(encoded) / 1e6:7.2f} MB on the wire "
+              f"({len(encoded) / payload_bytes - 1:+.1%}) | "
+              f"encode {encode_rate * payload_bytes / 1e6:8.0f} MB/s | "
+              f"decode {decode_rate * payload_bytes / 1e6:8.0f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
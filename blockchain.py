@@ -1,85 +1,267 @@
 import hashlib
 import datetime
+import json
+import struct
+import time
+import asyncio
+from collections import OrderedDict
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
 import base64
 from cryptography.hazmat.primitives import serialization
+from network.codec import encode_block, decode_block
+from network.compact import CompactRelay
 from network.node import Node
-from email.handler import EmailHandler
+from network.peer_manager import PeerManager
+from network.sync import ChainSync
+from mail.handler import EmailHandler
 from wallet.resolver import WalletResolver
 from consensus.proof_of_stake import ProofOfStake
-from email.smtp_interface import BlockchainEmailServer
+from consensus.miner import MiningEngine, DEFAULT_DIFFICULTY_BITS, target_for_bits, hash_meets_target
+from consensus.merkle import MerkleTree, MerkleProof, hash_leaf
+from consensus.header import HEADER_PREFIX, HEADER_NONCE, HEADER_SIZE, hash_to_bytes, bytes_to_hash
+from consensus.mempool import Mempool
+from consensus.validator import ChainValidator
+from mail.smtp_interface import BlockchainEmailServer
+from storage.block_store import BlockStore, BlockSequence
+from storage.recipient_index import RecipientIndex
+from mail.envelope import seal_message, chunk_associated_data, chunk_count
+import os
+
+# chunk id, total chunks, message id, recipient length, envelope length
+CHUNK_LEAF_HEADER = struct.Struct('>II16sHH')
 
 class EmailChunk:
-    def __init__(self, chunk_id, encrypted_content, recipient_address):
-        self.chunk_id = chunk_id
+    def __init__(self, chunk_id, encrypted_content, recipient_address, envelope=b'',
+                 message_id='', total_chunks=1):
+        self.chunk_id = chunk_id  # index of this chunk within its message
         self.encrypted_content = encrypted_content
         self.recipient_address = recipient_address
+        self.envelope = envelope  # RSA-wrapped content key of the message
+        self.message_id = message_id  # random 16-byte id, hex
+        self.total_chunks = total_chunks
         self.timestamp = datetime.datetime.now()
 
+    def leaf_hash(self) -> bytes:
+        # Commit to where the chunk goes as well as its ciphertext, since the
+        # block hash only covers the merkle root.
+        recipient = self.recipient_address.encode('utf-8')
+        return hash_leaf(CHUNK_LEAF_HEADER.pack(self.chunk_id, self.total_chunks,
+                                                bytes.fromhex(self.message_id),
+                                                len(recipient), len(self.envelope)) +
+                         recipient + bytes(self.envelope) + bytes(self.encrypted_content))
+
+    def to_dict(self) -> dict:
+        return {
+            'chunk_id': self.chunk_id,
+            'encrypted_content': base64.b64encode(self.encrypted_content).decode('ascii'),
+            'recipient_address': self.recipient_address,
+            'envelope': base64.b64encode(self.envelope).decode('ascii'),
+            'message_id': self.message_id,
+            'total_chunks': self.total_chunks,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'EmailChunk':
+        chunk = cls(data['chunk_id'],
+                    base64.b64decode(data['encrypted_content']),
+                    data['recipient_address'],
+                    base64.b64decode(data['envelope']),
+                    data['message_id'],
+                    data['total_chunks'])
+        chunk.timestamp = datetime.datetime.fromisoformat(data['timestamp'])
+        return chunk
+
+BLOCK_VERSION = 1
+
 class Block:
-    def __init__(self, email_chunks, previous_hash):
+    def __init__(self, email_chunks, previous_hash, timestamp=None):
+        self.version = BLOCK_VERSION
         self.email_chunks = email_chunks
         self.previous_hash = previous_hash
-        self.timestamp = datetime.datetime.now()
+        self.timestamp = int(time.time()) if timestamp is None else timestamp
         self.nonce = 0
+        self._merkle_tree = None
         self.merkle_root = self.calculate_merkle_root()
         self.hash = self.calculate_hash()
 
+    @property
+    def merkle_tree(self) -> MerkleTree:
+        # Built once per block object and then extended, so repeated
+        # validation and proof requests don't rehash every chunk.
+        tree = self._merkle_tree
+        if tree is None or len(tree) > len(self.email_chunks):
+            tree = self._merkle_tree = MerkleTree.from_leaves(
+                chunk.leaf_hash() for chunk in self.email_chunks)
+        for chunk in self.email_chunks[len(tree):]:
+            tree.append(chunk.leaf_hash())
+        return tree
+
     def calculate_merkle_root(self):
-        if not self.email_chunks:
-            return hashlib.sha256("empty".encode()).hexdigest()
-
-        chunk_hashes = [hashlib.sha256(str(chunk.encrypted_content).encode()).hexdigest()
-                       for chunk in self.email_chunks]
-        return self._build_merkle_tree(chunk_hashes)
-
-    def _build_merkle_tree(self, hashes):
-        if len(hashes) == 1:
-            return hashes[0]
-        new_hashes = []
-        for i in range(0, len(hashes)-1, 2):
-            combined = hashes[i] + hashes[i+1]
-            new_hashes.append(hashlib.sha256(combined.encode()).hexdigest())
-        if len(hashes) % 2 == 1:
-            new_hashes.append(hashes[-1])
-        return self._build_merkle_tree(new_hashes)
+        return self.merkle_tree.root.hex()
+
+    def add_chunk(self, chunk):
+        """Append a chunk, updating the merkle root in O(log n)."""
+        self.email_chunks.append(chunk)
+        self.merkle_root = self.calculate_merkle_root()
+
+    def inclusion_proof(self, position: int) -> MerkleProof:
+        """Proof that the chunk at position is committed to by merkle_root."""
+        return self.merkle_tree.proof(position)
+
+    def header_prefix(self) -> bytes:
+        return HEADER_PREFIX.pack(self.version,
+                                  hash_to_bytes(self.previous_hash),
+                                  hash_to_bytes(self.merkle_root),
+                                  self.timestamp)
+
+    def serialize_header(self) -> bytes:
+        return self.header_prefix() + HEADER_NONCE.pack(self.nonce)
 
     def calculate_hash(self):
-        sha = hashlib.sha256()
-        sha.update(str(self.email_chunks).encode('utf-8') +
-                   str(self.previous_hash).encode('utf-8') +
-                   str(self.nonce).encode('utf-8'))
-        return sha.hexdigest()
-
-    def mine_block(self, difficulty):
-        while self.hash[:len(difficulty)] != difficulty:
+        return hashlib.sha256(self.serialize_header()).hexdigest()
+
+    def meets_target(self, difficulty_bits: int) -> bool:
+        return (self.hash == self.calculate_hash() and
+                hash_meets_target(bytes.fromhex(self.hash), difficulty_bits))
+
+    def mine_block(self, difficulty_bits: int):
+        # Single-core search on the calling thread (MiningEngine is the
+        # parallel, awaitable equivalent). The fixed part of the header is
+        # hashed once; each attempt only feeds the nonce into a copy of it.
+        prefix = hashlib.sha256(self.header_prefix())
+        pack_nonce = HEADER_NONCE.pack
+        target = target_for_bits(difficulty_bits)
+        sha = prefix.copy()
+        sha.update(pack_nonce(self.nonce))
+        digest = sha.digest()
+        while digest > target:
             self.nonce += 1
-            self.hash = self.calculate_hash()
+            sha = prefix.copy()
+            sha.update(pack_nonce(self.nonce))
+            digest = sha.digest()
+        self.hash = digest.hex()
 
         print(f"Block mined: {self.hash}")
 
-genesis_block = Block("Genesis Block", "0")
+    def to_dict(self) -> dict:
+        return {
+            'version': self.version,
+            'email_chunks': [chunk.to_dict() for chunk in self.email_chunks],
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'nonce': self.nonce,
+            'merkle_root': self.merkle_root,
+            'hash': self.hash
+        }
+
+    @classmethod
+    def from_header_fields(cls, header, chunks, tree: MerkleTree = None,
+                           block_hash: str = None) -> 'Block':
+        """Restore a block from its packed header and chunks.
+
+        Nothing is recomputed: unlike __init__, the header's timestamp, nonce
+        and merkle root are kept as they are. tree, when the caller already
+        built it from chunks, saves validation from rehashing every chunk.
+        """
+        version, previous_hash, merkle_root, timestamp = HEADER_PREFIX.unpack_from(header)
+        nonce, = HEADER_NONCE.unpack_from(header, HEADER_PREFIX.size)
+        block = cls.__new__(cls)
+        block._merkle_tree = tree
+        block.version = version
+        block.email_chunks = chunks
+        block.previous_hash = bytes_to_hash(previous_hash)
+        block.timestamp = timestamp
+        block.nonce = nonce
+        block.merkle_root = merkle_root.hex()
+        block.hash = block_hash if block_hash is not None else \
+            hashlib.sha256(header[:HEADER_SIZE]).hexdigest()
+        return block
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Block':
+        header = HEADER_PREFIX.pack(data['version'],
+                                    hash_to_bytes(data['previous_hash']),
+                                    hash_to_bytes(data['merkle_root']),
+                                    data['timestamp']) + HEADER_NONCE.pack(data['nonce'])
+        return cls.from_header_fields(header,
+                                      [EmailChunk.from_dict(chunk) for chunk in data['email_chunks']],
+                                      block_hash=data['hash'])
+
+    def serialize(self) -> bytes:
+        return encode_block(self)
+
+    @classmethod
+    def deserialize(cls, payload: bytes) -> 'Block':
+        # Blocks stored before the binary codec are JSON objects.
+        if payload[:1] == b'{':
+            return cls.from_dict(json.loads(payload))
+        return decode_block(payload)[0]
+
+genesis_block = Block([], "0", timestamp=0)
 
 class Blockchain:
-    def __init__(self):
-        self.chain = [self.create_genesis_block()]
+    def __init__(self, data_dir: str = "chaindata", difficulty_bits: int = DEFAULT_DIFFICULTY_BITS):
+        self.difficulty_bits = difficulty_bits
+        self.listeners = []  # callback(height, block) run after each append
+        self.rollback_listeners = []  # callback(height, blocks) run after a rollback
+        self.store = BlockStore(data_dir)
+        self.chain = BlockSequence(self.store, Block.deserialize)
+        if len(self.store) == 0:
+            self._append(self.create_genesis_block())
 
     def create_genesis_block(self):
-        return Block("Genesis Block", "0")
+        # Fixed timestamp so every node derives the same genesis hash.
+        return Block([], "0", timestamp=0)
 
     def add_block(self, new_block):
-        new_block.previous_hash = self.chain[-1].hash
-        new_block.mine_block("0000")
-        self.chain.append(new_block)
+        # Blocks already mined on top of the current tip (by MiningEngine or
+        # a peer) are appended as-is; anything else is linked and mined here.
+        tip_hash = self.chain[-1].hash
+        if new_block.previous_hash != tip_hash or not new_block.meets_target(self.difficulty_bits):
+            new_block.previous_hash = tip_hash
+            new_block.mine_block(self.difficulty_bits)
+        self._append(new_block)
+
+    def _append(self, block):
+        height = self.store.append(bytes.fromhex(block.hash), block.serialize())
+        self.chain.remember(height, block)
+        for listener in self.listeners:
+            listener(height, block)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def rollback(self, height: int) -> list:
+        """Drop the blocks from height up, e.g. to switch to a longer branch; returns them."""
+        dropped = self.chain[height:]
+        self.store.truncate(height)
+        self.chain.forget(height)
+        for listener in self.rollback_listeners:
+            listener(height, dropped)
+        return dropped
+
+    def subscribe_rollback(self, listener):
+        self.rollback_listeners.append(listener)
+
+    def get_block_by_hash(self, block_hash: str):
+        payload = self.store.get_by_hash(bytes.fromhex(block_hash))
+        return Block.deserialize(payload) if payload is not None else None
+
+    def close(self):
+        self.store.close()
 
 class Wallet:
-    def __init__(self):
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048
-        )
+    def __init__(self, private_key=None):
+        # Pass a key from client.core.key_pool.KeyPool to skip generating one here.
+        if private_key is None:
+            private_key = rsa.generate_private_key(
+                public_exponent=65537,
+                key_size=2048
+            )
+        self.private_key = private_key
         self.public_key = self.private_key.public_key()
         self.address = self.generate_address()
 
@@ -92,38 +274,187 @@ class Wallet:
         return hashlib.sha256(public_bytes).hexdigest()
 
 class EmailProtocol:
-    def __init__(self, blockchain):
+    def __init__(self, blockchain, wallet_resolver=None, mempool=None):
         self.blockchain = blockchain
-        self.chunk_size = 1024  # Size of each email chunk in bytes
+        self.wallet_resolver = wallet_resolver or WalletResolver()
+        self.mempool = mempool
+        # Chunks are AES-GCM sealed, so their size is no longer bounded by
+        # the RSA modulus; it only sets the granularity of the merkle tree.
+        self.chunk_size = 16 * 1024  # Size of each email chunk in bytes
+
+    def encrypt_message(self, recipient_address, content):
+        # One RSA wrap of a fresh content key per message, then AES-GCM per chunk
+        public_key = self.wallet_resolver.get_key(recipient_address)
+        if public_key is None:
+            raise ValueError(f"Unknown recipient wallet: {recipient_address}")
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        message_id = os.urandom(16).hex()
+        total_chunks = chunk_count(len(content), self.chunk_size)
+        associated_data = chunk_associated_data(recipient_address, message_id, total_chunks)
+        envelope, ciphertexts = seal_message(public_key, content,
+                                             self.chunk_size, associated_data)
+        return [EmailChunk(i, ciphertext, recipient_address, envelope, message_id, total_chunks)
+                for i, ciphertext in enumerate(ciphertexts)]
 
     def send_email(self, sender_wallet, recipient_address, content):
-        # Split email into chunks and encrypt each chunk
-        chunks = [content[i:i+self.chunk_size] for i in range(0, len(content), self.chunk_size)]
-        encrypted_chunks = []
+        """Queue (or, without a mempool, mine) an email; returns its message id."""
+        encrypted_chunks = self.encrypt_message(recipient_address, content)
 
-        for i, chunk in enumerate(chunks):
-            # Encrypt chunk with recipient's public key
-            encrypted_chunk = self.encrypt_chunk(chunk, recipient_address)
-            chunk_obj = EmailChunk(i, encrypted_chunk, recipient_address)
-            encrypted_chunks.append(chunk_obj)
+        # With a mempool the chunks share blocks with other senders' mail
+        if self.mempool is not None:
+            self.mempool.add(encrypted_chunks)
+            return encrypted_chunks[0].message_id
 
         # Create new block with encrypted chunks
         new_block = Block(encrypted_chunks, self.blockchain.chain[-1].hash)
         self.blockchain.add_block(new_block)
+        return encrypted_chunks[0].message_id
 
 class EmailBlockchain:
-    def __init__(self, host='127.0.0.1', port=8000):
-        self.blockchain = Blockchain()
-        self.wallet_resolver = WalletResolver()
-        self.consensus = ProofOfStake()
+    def __init__(self, host='127.0.0.1', port=8000, data_dir='chaindata', seed_peers=(),
+                 difficulty_bits=DEFAULT_DIFFICULTY_BITS, smtp_port=8025, mining_workers=None,
+                 discover_peers=True):
+        self.blockchain = Blockchain(data_dir, difficulty_bits)
+        self.validator = ChainValidator(data_dir, Block.deserialize, self.blockchain.difficulty_bits)
+        self.wallet_resolver = WalletResolver(os.path.join(data_dir, 'wallets.db'))
+        self.consensus = ProofOfStake(self.blockchain, schedule_dir=os.path.join(data_dir, 'schedules'))
+        self.mempool = Mempool()
+        self.protocol = EmailProtocol(self.blockchain, self.wallet_resolver, self.mempool)
+        self._mining_task = None
         self.node = Node(host, port)
-        self.email_handler = EmailHandler(self.blockchain, None)
-        self.smtp_server = BlockchainEmailServer()
+        self.node.on_new_block = self.handle_new_block
+        for peer in seed_peers:
+            self.node.add_peer(*peer)
+        self.peer_manager = PeerManager(self.node, path=os.path.join(data_dir, 'peers.json'))
+        self.discover_peers = discover_peers  # False keeps exactly the seed peers
+        self.sync = ChainSync(self.node, self.blockchain)
+        self.relay = CompactRelay(self.node, self.blockchain)
+        self._loop = None
+        self._sync_task = None
+        self.miner = MiningEngine(mining_workers)
+        self._mined = OrderedDict()  # hashes of recent blocks mined here
+        self._orphaned = []  # chunks of our blocks that a reorg dropped
+        self._orphaned_from = None  # lowest height a reorg dropped since the last requeue
+        self.blockchain.subscribe_rollback(self.on_rollback)
+        self.recipient_index = RecipientIndex(os.path.join(data_dir, 'recipients.db'))
+        self.recipient_index.attach(self.blockchain)
+        self.email_handler = EmailHandler(self.blockchain, None, self.recipient_index)
+        # smtp_port=None runs the node without an SMTP front end
+        self.smtp_server = (BlockchainEmailServer(self.protocol, host, smtp_port)
+                            if smtp_port is not None else None)
 
     async def start(self):
+        # Only blocks appended since the last checkpoint are re-verified.
+        report = await asyncio.get_running_loop().run_in_executor(
+            None, self.validator.verify, self.blockchain.store)
+        if not report.valid:
+            raise ValueError(f"Stored chain is invalid at height {report.invalid_height}: {report.reason}")
+        if report.stop > report.start:
+            print(f"Verified blocks {report.start}-{report.stop - 1}")
+        self._loop = asyncio.get_running_loop()
+        self.mempool.subscribe(self.on_mempool_add)
         await self.node.start()
-        self.smtp_server.start()
+        if self.discover_peers:
+            self.peer_manager.start()
+        self.request_sync()
+        if self.smtp_server is not None:
+            self.smtp_server.start()
+        self._mining_task = asyncio.create_task(self.mine_mempool())
+
+    def on_mempool_add(self, chunks):
+        # Runs on whichever thread queued the email (e.g. the SMTP server's).
+        self._loop.call_soon_threadsafe(
+            lambda: asyncio.ensure_future(self.relay.gossip_chunks(chunks)))
+
+    async def mine_mempool(self):
+        """Turn each batch the mempool seals into a mined block."""
+        while True:
+            chunks = await self.mempool.next_batch()
+            # If a competing block wins the race, rebuild on the new tip.
+            while await self.mine_block(Block(chunks, self.blockchain.chain[-1].hash)) is None:
+                pass
+
+    async def mine_block(self, block):
+        """Mine block on top of the current tip off the event loop and append it.
+
+        Returns None if mining was cancelled because a competing block won.
+        """
+        block.previous_hash = self.blockchain.chain[-1].hash
+        result = await self.miner.mine(block, self.blockchain.difficulty_bits)
+        if result.cancelled or block.previous_hash != self.blockchain.chain[-1].hash:
+            return None
+        print(f"Block mined: {block.hash} ({result.hashrate:,.0f} H/s)")
+        self.blockchain.add_block(block)
+        self._mined[block.hash] = None
+        if len(self._mined) > 1024:
+            self._mined.popitem(last=False)
+        await self.relay.announce(block)
+        return block
+
+    def request_sync(self):
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self.run_sync())
+
+    async def run_sync(self):
+        try:
+            appended = await self.sync.sync()
+        except Exception as e:
+            print(f"Chain sync failed: {e}")
+            return
+        finally:
+            self.requeue_orphaned()
+        if appended:
+            print(f"Synced {appended} blocks, now at height {len(self.blockchain.chain) - 1}")
+
+    def on_rollback(self, height, blocks):
+        # Mail we mined into blocks a reorg dropped would be lost; it is
+        # requeued once the sync that switched branches is done.
+        for block in blocks:
+            if block.hash in self._mined:
+                del self._mined[block.hash]
+                self._orphaned.extend(block.email_chunks)
+        if self._orphaned_from is None or height < self._orphaned_from:
+            self._orphaned_from = height
+
+    def requeue_orphaned(self):
+        """Put orphaned chunks the new branch doesn't carry back in the mempool."""
+        if not self._orphaned:
+            return
+        chain = self.blockchain.chain
+        included = {leaf for height in range(self._orphaned_from, len(chain))
+                    for leaf in chain[height].merkle_tree.levels[0]}
+        chunks = [chunk for chunk in self._orphaned if chunk.leaf_hash() not in included]
+        self._orphaned, self._orphaned_from = [], None
+        if chunks:
+            print(f"Requeued {len(chunks)} chunks from blocks dropped by a reorg")
+            self.mempool.add(chunks)
+
+    async def handle_new_block(self, block):
+        tip_hash = self.blockchain.chain[-1].hash
+        if block.previous_hash != tip_hash and self.blockchain.store.height_of(
+                hash_to_bytes(block.previous_hash)) is None:
+            # Builds on blocks we don't have yet: we've fallen behind.
+            self.request_sync()
+            return
+        if (block.previous_hash == tip_hash and
+                block.meets_target(self.blockchain.difficulty_bits) and
+                self.consensus.validate_block(block, None)):
+            # Someone else extended the tip first: stop working on ours.
+            self.miner.cancel()
+            self.blockchain.add_block(block)
+            await self.relay.announce(block)
 
     def stop(self):
-        self.smtp_server.stop()
+        for task in (self._mining_task, self._sync_task):
+            if task is not None:
+                task.cancel()
+        if self.smtp_server is not None:
+            self.smtp_server.stop()
+        self.peer_manager.stop()
+        self.node.close()
+        self.miner.shutdown()
+        self.recipient_index.close()
+        self.wallet_resolver.close()
+        self.blockchain.close()
 
@@ -61,6 +61,10 @@ class ClientController(QObject):
         self.settings.update(new_settings)
         self.settings_manager.save_settings(self.settings)
 
+    def close(self):
+        """Release background resources on application exit."""
+        self.wallet_manager.close()
+
     def has_wallet(self) -> bool:
         """Check if a wallet exists."""
         return self.wallet_manager.get_current_wallet() is not None
@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import threading
+import time
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.backends import default_backend
+
+def _generate_key(key_size: int) -> bytes:
+    """Runs in the pool process; DER bytes pickle cheaply back to the caller."""
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=key_size,
+        backend=default_backend()
+    )
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+class KeyPool:
+    """Keeps a few RSA keypairs generated ahead of time so new wallets are instant.
+
+    Keys are generated in a background process and stored in pool_dir,
+    each Fernet-encrypted with a pool key that is kept beside them with
+    owner-only permissions. take() hands out the oldest stored key and
+    starts generating its replacement. When the pool is empty it waits for
+    the key the background process is working on, and only generates one
+    inline when nothing is being generated (e.g. on the very first run) or
+    the wait times out.
+    """
+
+    def __init__(self, pool_dir: str, size: int = 3, key_size: int = 2048):
+        self.pool_dir = pool_dir
+        self.size = size
+        self.key_size = key_size
+        os.makedirs(pool_dir, exist_ok=True)
+        self._fernet = Fernet(self._load_pool_key())
+        self._lock = threading.Lock()
+        self._key_ready = threading.Condition(self._lock)  # a key was stored or failed
+        self._pool = None
+        self._generating = 0
+        self._closed = False
+
+    def _load_pool_key(self) -> bytes:
+        key_path = os.path.join(self.pool_dir, 'pool.key')
+        try:
+            with open(key_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            key = Fernet.generate_key()
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key)
+            return key
+
+    def _stored(self):
+        """Paths of stored keys, oldest first."""
+        stored = []
+        for name in os.listdir(self.pool_dir):
+            if not name.endswith('.key.enc'):
+                continue
+            path = os.path.join(self.pool_dir, name)
+            try:
+                stored.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                continue  # claimed by another client since listdir
+        return [path for _, path in sorted(stored)]
+
+    def available(self) -> int:
+        return len(self._stored())
+
+    def refill(self):
+        """Start generating keys until the pool (stored plus in progress) is full."""
+        with self._lock:
+            if self._closed:
+                return
+            missing = self.size - len(self._stored()) - self._generating
+            if missing <= 0:
+                return
+            if self._pool is None:
+                # spawn rather than fork: the GUI process has Qt threads running.
+                self._pool = multiprocessing.get_context('spawn').Pool(processes=1)
+            for _ in range(missing):
+                self._generating += 1
+                self._pool.apply_async(_generate_key, (self.key_size,),
+                                       callback=self._store, error_callback=self._failed)
+
+    def _store(self, key_der: bytes):
+        # Runs on the pool's result thread.
+        try:
+            name = os.urandom(8).hex() + '.key.enc'
+            tmp_path = os.path.join(self.pool_dir, name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(self._fernet.encrypt(key_der))
+            os.replace(tmp_path, os.path.join(self.pool_dir, name))
+        except Exception as e:
+            self._failed(e)
+            return
+        with self._lock:
+            self._generating -= 1
+            self._key_ready.notify_all()
+
+    def _failed(self, error: BaseException):
+        if not self._closed:
+            print(f"Error pre-generating key: {error}")
+        with self._lock:
+            self._generating -= 1
+            self._key_ready.notify_all()
+
+    def _claim(self):
+        """The oldest stored key, or None if the pool is empty."""
+        for path in self._stored():
+            # Renaming claims the key atomically, even against another client.
+            claimed = f"{path}.{os.getpid()}.taken"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(claimed, 'rb') as f:
+                    key_der = self._fernet.decrypt(f.read())
+                # Fernet authenticates what we stored, so the slow RSA
+                # consistency check on load is only repeating work.
+                return serialization.load_der_private_key(key_der, password=None,
+                                                          unsafe_skip_rsa_key_validation=True)
+            except Exception as e:
+                print(f"Discarding unreadable pooled key: {e}")
+            finally:
+                os.remove(claimed)
+        return None
+
+    def take(self, timeout: float = 30.0) -> rsa.RSAPrivateKey:
+        """A fresh private key, from the pool when one is ready or in progress."""
+        deadline = time.monotonic() + timeout
+        key = self._claim()
+        while key is None:
+            with self._lock:
+                remaining = deadline - time.monotonic()
+                if self._closed or self._generating <= 0 or remaining <= 0:
+                    break
+                self._key_ready.wait(remaining)
+            key = self._claim()
+        if key is None:
+            # The last generation may have finished just before we looked.
+            key = self._claim()
+        if key is None:
+            key = serialization.load_der_private_key(_generate_key(self.key_size), password=None,
+                                                     backend=default_backend())
+        self.refill()
+        return key
+
+    def close(self):
+        """Stop the generator process, abandoning a key it is still working on."""
+        with self._lock:
+            self._closed = True
+            self._key_ready.notify_all()
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
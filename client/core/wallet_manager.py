@@ -6,6 +6,7 @@ from cryptography.hazmat.primitives.asymmetric import rsa, padding
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 import base64
+from client.core.key_pool import KeyPool
 
 class Wallet:
     def __init__(self, private_key: Optional[rsa.RSAPrivateKey] = None):
@@ -53,6 +54,9 @@ class WalletManager:
         self.wallets_dir = os.path.join(self.data_dir, 'wallets')
         os.makedirs(self.wallets_dir, exist_ok=True)
         self.current_wallet: Optional[Wallet] = None
+        # Keys are generated ahead of time so create_wallet doesn't block the UI.
+        self.key_pool = KeyPool(os.path.join(self.data_dir, 'keypool'))
+        self.key_pool.refill()
 
     def _get_data_dir(self) -> str:
         """Get or create the data directory for the application."""
@@ -66,7 +70,7 @@ class WalletManager:
 
     def create_wallet(self) -> Wallet:
         """Create a new wallet and save it."""
-        self.current_wallet = Wallet()
+        self.current_wallet = Wallet(self.key_pool.take())
         self.save_wallet(self.current_wallet.address)
         print(f"Created new wallet with address: {self.current_wallet.address}")
         return self.current_wallet
@@ -113,6 +117,10 @@ class WalletManager:
             except Exception as e:
                 print(f"Error saving wallet: {e}")
 
+    def close(self):
+        """Shut down the key pool's generator process."""
+        self.key_pool.close()
+
     def clear_current_wallet(self):
         """Clear the current wallet from memory."""
         self.current_wallet = None
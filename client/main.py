@@ -10,19 +10,23 @@ def main():
     
     controller = ClientController()
     
-    while True:
-        login = LoginWindow(controller)
-        if login.exec() != QDialog.DialogCode.Accepted:
-            sys.exit(0)
+    try:
+        while True:
+            login = LoginWindow(controller)
+            if login.exec() != QDialog.DialogCode.Accepted:
+                sys.exit(0)
+                
+            window = MainWindow(controller)
+            window.show()
+            result = app.exec()
             
-        window = MainWindow(controller)
-        window.show()
-        result = app.exec()
-        
-        if not controller.is_logged_in():
-            continue
-        else:
-            sys.exit(result)
+            if not controller.is_logged_in():
+                continue
+            else:
+                sys.exit(result)
+    finally:
+        # Otherwise exit waits for the key pool to finish a key it's generating.
+        controller.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
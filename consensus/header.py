@@ -0,0 +1,18 @@
+import struct
+
+# Block header layout shared by the chain, the codec and sync:
+# version, previous hash, merkle root, timestamp. The nonce follows as the
+# last 8 bytes, so everything before it can be hashed once per block.
+HEADER_PREFIX = struct.Struct('>I32s32sQ')
+HEADER_NONCE = struct.Struct('>Q')
+HEADER_SIZE = HEADER_PREFIX.size + HEADER_NONCE.size
+
+
+def hash_to_bytes(value) -> bytes:
+    # The genesis block links to "0"; treat it (and unset links) as all zeroes.
+    return bytes.fromhex(value.zfill(64)) if value else bytes(32)
+
+
+def bytes_to_hash(value: bytes) -> str:
+    """Inverse of hash_to_bytes: an all-zero link reads back as "0"."""
+    return value.hex() if any(value) else "0"
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+
+def chunk_size(chunk) -> int:
+    return len(chunk.encrypted_content) + len(chunk.envelope) + len(chunk.recipient_address)
+
+
+class Mempool:
+    """Pending email chunks from all senders, sealed into block-sized batches.
+
+    A batch is sealed as soon as the pending chunks reach max_block_bytes or
+    max_block_chunks, or when the oldest pending chunk has waited
+    max_latency seconds. add() is thread-safe; sealed batches are consumed
+    from the event loop with next_batch().
+    """
+
+    def __init__(self, max_block_bytes: int = 1024 * 1024, max_block_chunks: int = 1024,
+                 max_latency: float = 2.0):
+        self.max_block_bytes = max_block_bytes
+        self.max_block_chunks = max_block_chunks
+        self.max_latency = max_latency
+
+        self._pending = deque()  # (monotonic arrival time, chunk) not yet sealed
+        self._pending_bytes = 0
+        self._sealed = deque()  # batches waiting to be mined
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ready = None  # asyncio.Event, created on the consuming loop
+
+        self.listeners = []  # callback(chunks) run on the adding thread after each add
+        self.added_chunks = 0
+        self.sealed_blocks = 0
+        self.seal_reasons = {'bytes': 0, 'chunks': 0, 'deadline': 0}
+
+    def add(self, chunks: List):
+        now = time.monotonic()
+        with self._lock:
+            # The consumer has no deadline to wait for while the pool is empty.
+            was_empty = not self._pending
+            for chunk in chunks:
+                self._pending.append((now, chunk))
+                self._pending_bytes += chunk_size(chunk)
+            self.added_chunks += len(chunks)
+            sealed = self._seal_full()
+        if sealed or was_empty:
+            self._wakeup()
+        for listener in self.listeners:
+            listener(chunks)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _seal_full(self) -> bool:
+        sealed = False
+        while self._pending_bytes >= self.max_block_bytes or len(self._pending) >= self.max_block_chunks:
+            reason = 'bytes' if self._pending_bytes >= self.max_block_bytes else 'chunks'
+            self._seal(reason)
+            sealed = True
+        return sealed
+
+    def _seal(self, reason: str):
+        batch, batch_bytes = [], 0
+        while self._pending and len(batch) < self.max_block_chunks:
+            size = chunk_size(self._pending[0][1])
+            # Always take at least one chunk, even one bigger than a block.
+            if batch and batch_bytes + size > self.max_block_bytes:
+                break
+            batch.append(self._pending.popleft()[1])
+            batch_bytes += size
+        self._pending_bytes -= batch_bytes
+        self._sealed.append(batch)
+        self.sealed_blocks += 1
+        self.seal_reasons[reason] += 1
+
+    def _wakeup(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+
+    def _time_to_deadline(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return max(0.0, self._pending[0][0] + self.max_latency - time.monotonic())
+
+    async def next_batch(self) -> List:
+        """Wait for the next sealed batch, sealing on the latency deadline if needed."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._ready = asyncio.Event()
+        while True:
+            with self._lock:
+                if self._sealed:
+                    return self._sealed.popleft()
+                timeout = self._time_to_deadline()
+                self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    if self._pending and self._time_to_deadline() == 0.0:
+                        self._seal('deadline')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pending_chunks': len(self._pending),
+                'pending_bytes': self._pending_bytes,
+                'oldest_pending_age': time.monotonic() - self._pending[0][0] if self._pending else 0.0,
+                'sealed_waiting': len(self._sealed),
+                'added_chunks': self.added_chunks,
+                'sealed_blocks': self.sealed_blocks,
+                'seal_reasons': dict(self.seal_reasons)
+            }
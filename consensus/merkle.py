@@ -0,0 +1,115 @@
+import hashlib
+import struct
+from typing import Iterable, List
+
+# Leaves and interior nodes are hashed with different prefixes so an interior
+# node can never be passed off as a leaf. When a level has an odd number of
+# nodes, the last one is promoted to the next level unchanged.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+EMPTY_ROOT = hashlib.sha256("empty".encode()).digest()
+
+PROOF_HEADER = struct.Struct('>II')  # leaf index, leaf count
+
+
+def hash_leaf(data: bytes) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+
+def hash_node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+class MerkleProof:
+    def __init__(self, index: int, leaf_count: int, siblings: List[bytes]):
+        self.index = index
+        self.leaf_count = leaf_count
+        self.siblings = siblings
+
+    def to_bytes(self) -> bytes:
+        # Sibling sides follow from index and leaf_count, so only the
+        # digests themselves need to be shipped.
+        return PROOF_HEADER.pack(self.index, self.leaf_count) + b''.join(self.siblings)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'MerkleProof':
+        index, leaf_count = PROOF_HEADER.unpack_from(data)
+        body = data[PROOF_HEADER.size:]
+        return cls(index, leaf_count, [bytes(body[i:i + 32]) for i in range(0, len(body), 32)])
+
+
+def verify_proof(leaf_digest: bytes, proof: MerkleProof, root: bytes) -> bool:
+    """Check that leaf_digest sits at proof.index in a tree with the given root."""
+    if not 0 <= proof.index < proof.leaf_count:
+        return False
+    digest, index, width = leaf_digest, proof.index, proof.leaf_count
+    siblings = iter(proof.siblings)
+    try:
+        while width > 1:
+            if index % 2:
+                digest = hash_node(next(siblings), digest)
+            elif index + 1 < width:
+                digest = hash_node(digest, next(siblings))
+            index, width = index // 2, (width + 1) // 2
+    except StopIteration:
+        return False
+    return next(siblings, None) is None and digest == root
+
+
+class MerkleTree:
+    """Merkle tree that keeps every level, so appends and proofs are O(log n)."""
+
+    def __init__(self):
+        self.levels: List[List[bytes]] = [[]]
+
+    @classmethod
+    def from_leaves(cls, leaf_digests: Iterable[bytes]) -> 'MerkleTree':
+        # Building level by level hashes each interior node once, which is
+        # cheaper than n individual appends.
+        tree = cls()
+        level = list(leaf_digests)
+        tree.levels = [level]
+        while len(level) > 1:
+            parent = [hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                parent.append(level[-1])
+            tree.levels.append(parent)
+            level = parent
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0] if self.levels[0] else EMPTY_ROOT
+
+    def append(self, leaf_digest: bytes):
+        # Only the rightmost path changes when a leaf is added.
+        self.levels[0].append(leaf_digest)
+        index, depth = len(self.levels[0]) - 1, 0
+        while len(self.levels[depth]) > 1:
+            nodes = self.levels[depth]
+            left = index - index % 2
+            parent = hash_node(nodes[left], nodes[left + 1]) if left + 1 < len(nodes) else nodes[left]
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[depth + 1]
+            index //= 2
+            if index < len(parents):
+                parents[index] = parent
+            else:
+                parents.append(parent)
+            depth += 1
+
+    def proof(self, index: int) -> MerkleProof:
+        if not 0 <= index < len(self):
+            raise IndexError("leaf index out of range")
+        siblings = []
+        position = index
+        for nodes in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(nodes):
+                siblings.append(nodes[sibling])
+            position //= 2
+        return MerkleProof(index, len(self), siblings)
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+DEFAULT_DIFFICULTY_BITS = 16  # same work as the old "0000" hex prefix
+MAX_NONCE = 1 << 64
+
+_pack_nonce = struct.Struct('>Q').pack
+_cancel_event = None  # set in each pool worker by _init_worker
+
+
+def target_for_bits(difficulty_bits: int) -> bytes:
+    """Largest hash that still has difficulty_bits leading zero bits."""
+    return ((1 << (256 - difficulty_bits)) - 1).to_bytes(32, 'big')
+
+
+def hash_meets_target(digest: bytes, difficulty_bits: int) -> bool:
+    # Equal-length big-endian byte strings compare like the integers they encode.
+    return digest <= target_for_bits(difficulty_bits)
+
+
+def _init_worker(cancel_event):
+    global _cancel_event
+    _cancel_event = cancel_event
+
+
+def search_nonces(header_prefix: bytes, target: bytes, start: int, stop: int,
+                  check_every: int = 1 << 14):
+    """Scan [start, stop) for a nonce whose header hash is at most target.
+
+    Returns (nonce, digest, attempts); nonce is None if the range ran out or
+    the search was cancelled.
+    """
+    prefix = hashlib.sha256(header_prefix)
+    for batch_start in range(start, stop, check_every):
+        if _cancel_event is not None and _cancel_event.is_set():
+            return None, None, batch_start - start
+        for nonce in range(batch_start, min(batch_start + check_every, stop)):
+            sha = prefix.copy()
+            sha.update(_pack_nonce(nonce))
+            digest = sha.digest()
+            if digest <= target:
+                return nonce, digest, nonce - start + 1
+    return None, None, stop - start
+
+
+class MiningResult:
+    def __init__(self, nonce: Optional[int], block_hash: Optional[str], attempts: int, elapsed: float):
+        self.nonce = nonce
+        self.hash = block_hash
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def cancelled(self) -> bool:
+        return self.nonce is None
+
+    @property
+    def hashrate(self) -> float:
+        return self.attempts / self.elapsed if self.elapsed else 0.0
+
+
+class MiningEngine:
+    """Nonce search spread over a process pool, driven from asyncio.
+
+    The nonce space is handed out in fixed-size ranges, keeping one range in
+    flight per worker. cancel() stops every worker at its next check, e.g.
+    when a competing block for the same height arrives. A cancel() that
+    lands just before mine() starts still cancels that job.
+    """
+
+    def __init__(self, workers: Optional[int] = None, range_size: int = 1 << 20):
+        self.workers = workers or os.cpu_count() or 1
+        self.range_size = range_size
+        self.last_hashrate = 0.0
+        self._cancel = multiprocessing.Event()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         initializer=_init_worker,
+                                         initargs=(self._cancel,))
+
+    def cancel(self):
+        self._cancel.set()
+
+    async def mine(self, block, difficulty_bits: int = DEFAULT_DIFFICULTY_BITS) -> MiningResult:
+        """Find a nonce for block; on success its nonce and hash are updated."""
+        loop = asyncio.get_running_loop()
+        header_prefix = block.header_prefix()
+        target = target_for_bits(difficulty_bits)
+        next_nonce = 0
+        pending = set()
+        attempts = 0
+        found = None
+        start = time.perf_counter()
+
+        def submit():
+            nonlocal next_nonce
+            stop = min(next_nonce + self.range_size, MAX_NONCE)
+            pending.add(loop.run_in_executor(self._pool, search_nonces,
+                                             header_prefix, target, next_nonce, stop))
+            next_nonce = stop
+
+        try:
+            while len(pending) < self.workers and next_nonce < MAX_NONCE:
+                submit()
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    pending.discard(future)
+                    nonce, digest, tried = future.result()
+                    attempts += tried
+                    if nonce is not None and (found is None or nonce < found[0]):
+                        found = (nonce, digest)
+                if found is not None:
+                    self._cancel.set()
+                elif not self._cancel.is_set() and next_nonce < MAX_NONCE:
+                    submit()
+        finally:
+            # Also reached when the awaiting task itself is cancelled. The
+            # flag is only cleared once no worker is left to see it.
+            self._cancel.set()
+            if pending:
+                await asyncio.wait(pending)
+            self._cancel.clear()
+
+        elapsed = time.perf_counter() - start
+        self.last_hashrate = attempts / elapsed if elapsed else 0.0
+        if found is None:
+            return MiningResult(None, None, attempts, elapsed)
+        block.nonce = found[0]
+        block.hash = found[1].hex()
+        return MiningResult(block.nonce, block.hash, attempts, elapsed)
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=True)
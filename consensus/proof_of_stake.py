@@ -1,42 +1,110 @@
+import os
 import random
-from typing import List
+from typing import Dict, List, Optional
+from consensus.miner import DEFAULT_DIFFICULTY_BITS
+from consensus.merkle import MerkleProof, verify_proof
+from consensus.validator import check_block
+from consensus.stake_registry import StakeRegistry
+from consensus.schedule import EpochSchedule, StakeSnapshot, epoch_seed
+
+class UnscheduledEpoch(LookupError):
+    """No proposer schedule was fixed for the epoch when its seed block was appended."""
 
 class ProofOfStake:
-    def __init__(self):
-        self.stakers = {}  # wallet_address -> stake_amount
+    def __init__(self, blockchain=None, slots_per_epoch: int = 128, schedule_dir: Optional[str] = None):
+        self.blockchain = blockchain
+        self.stake_registry = StakeRegistry()
         self.validators = []
+        self.slots_per_epoch = slots_per_epoch
+        self.schedule_dir = schedule_dir
+        self.schedules: Dict[int, EpochSchedule] = {}  # epoch -> proposer schedule
+        if schedule_dir:
+            os.makedirs(schedule_dir, exist_ok=True)
+        if blockchain is not None:
+            blockchain.subscribe(self.on_block_appended)
+
+    @property
+    def stakers(self) -> Dict[str, float]:
+        # wallet_address -> stake_amount; a copy, built on demand
+        return dict(self.stake_registry.items())
 
     def add_stake(self, wallet_address: str, amount: float):
-        if wallet_address in self.stakers:
-            self.stakers[wallet_address] += amount
-        else:
-            self.stakers[wallet_address] = amount
+        self.stake_registry.add_stake(wallet_address, amount)
 
-    def select_validator(self) -> str:
-        total_stake = sum(self.stakers.values())
-        target = random.uniform(0, total_stake)
-        current_stake = 0
+    def select_validator(self, rng: Optional[random.Random] = None) -> str:
+        # O(log n) stake-weighted draw; pass a seeded Random to reproduce it
+        return self.stake_registry.sample(rng)
 
-        for address, stake in self.stakers.items():
-            current_stake += stake
-            if current_stake >= target:
-                return address
+    def _schedule_path(self, epoch: int) -> str:
+        return os.path.join(self.schedule_dir, f'epoch_{epoch}.json')
 
-        return list(self.stakers.keys())[0]  # Fallback
+    def schedule_epoch(self, epoch: int) -> EpochSchedule:
+        """Fix the proposers of every slot in epoch from the current stake table.
 
-    def validate_block(self, block, validator_address: str) -> bool:
-        # Basic validation rules
-        if not block.hash.startswith('0000'):  # Difficulty check
-            return False
+        The seed is the hash of the last block before the epoch (the genesis
+        block for epoch 0), so it can only be computed once that block exists.
+        Later epochs are scheduled as their seed block is appended; epoch 0
+        has to be scheduled explicitly once the initial stakes are in.
+        """
+        seed_height = max(0, epoch * self.slots_per_epoch - 1)
+        if seed_height >= len(self.blockchain.chain):
+            raise ValueError(f"Seed block for epoch {epoch} is not on the chain yet")
+        seed = epoch_seed(self.blockchain.chain[seed_height].hash, epoch)
+        schedule = EpochSchedule(epoch, self.slots_per_epoch, seed,
+                                 StakeSnapshot(self.stake_registry.items()))
+        self.schedules[epoch] = schedule
+        if self.schedule_dir:
+            schedule.save(self._schedule_path(epoch))
+        # Only the current and next epoch are ever looked up.
+        for old_epoch in [e for e in self.schedules if e < epoch - 1]:
+            del self.schedules[old_epoch]
+        return schedule
 
-        if block.previous_hash != self.blockchain.chain[-1].hash:
-            return False
+    def on_block_appended(self, height: int, block):
+        # The last block of an epoch seeds the next one; snapshot stakes then
+        # so every node schedules from the same point in the chain.
+        if (height + 1) % self.slots_per_epoch == 0 and len(self.stake_registry):
+            epoch = (height + 1) // self.slots_per_epoch
+            try:
+                self.schedule_epoch(epoch)
+            except ValueError as e:
+                # Runs after the block is stored; failing here would only
+                # break whoever appended it. The epoch stays unscheduled.
+                print(f"Could not schedule epoch {epoch}: {e}")
 
-        if not self.verify_merkle_root(block):
-            return False
+    def proposer_for_slot(self, slot: int) -> str:
+        """Scheduled proposer of slot; raises UnscheduledEpoch if its epoch has no schedule.
 
-        return True
+        A missing schedule is never rebuilt here: today's stake table may
+        differ from the one at the seed block, and nodes would then disagree.
+        """
+        epoch = slot // self.slots_per_epoch
+        schedule = self.schedules.get(epoch)
+        if schedule is None:
+            if not (self.schedule_dir and os.path.exists(self._schedule_path(epoch))):
+                raise UnscheduledEpoch(f"Epoch {epoch} has no proposer schedule")
+            schedule = self.schedules[epoch] = EpochSchedule.load(self._schedule_path(epoch))
+        return schedule.proposer(slot)
+
+    def validate_block(self, block, validator_address: str) -> bool:
+        if validator_address is not None:
+            try:
+                proposer = self.proposer_for_slot(len(self.blockchain.chain))
+            except UnscheduledEpoch:
+                return False  # nobody can be checked against a schedule we don't have
+            if validator_address != proposer:
+                return False
+
+        # Basic validation rules: links to our tip, meets the difficulty
+        # target and its merkle root matches its chunks
+        difficulty_bits = getattr(self.blockchain, 'difficulty_bits', DEFAULT_DIFFICULTY_BITS)
+        return check_block(block, self.blockchain.chain[-1].hash, difficulty_bits) is None
 
     def verify_merkle_root(self, block) -> bool:
         calculated_root = block.calculate_merkle_root()
-        return calculated_root == block.merkle_root
\ No newline at end of file
+        return calculated_root == block.merkle_root
+
+    def verify_chunk_inclusion(self, chunk, proof: MerkleProof, merkle_root: str) -> bool:
+        # Checks a single chunk against a block's root without the rest of
+        # the block: O(log n) hashes.
+        return verify_proof(chunk.leaf_hash(), proof, bytes.fromhex(merkle_root))
\ No newline at end of file
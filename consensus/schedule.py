@@ -0,0 +1,101 @@
+import hashlib
+import json
+import struct
+from typing import List, Tuple
+
+# Proposers are fixed per epoch: from a snapshot of the stake table and a
+# seed taken from the chain, every node derives the same proposer for every
+# slot (block height) of the epoch up front. The draws use SHA-256 rather
+# than the random module so they don't depend on the Python version.
+
+SLOT_DRAW = struct.Struct('>QQ')  # alias table column, biased coin
+
+
+class StakeSnapshot:
+    """Frozen, canonically ordered copy of the stake table with an alias table."""
+
+    def __init__(self, stakes: List[Tuple[str, float]]):
+        # Sorted so nodes that registered stakes in a different order still
+        # agree on the table.
+        stakes = sorted((address, stake) for address, stake in stakes if stake > 0)
+        if not stakes:
+            raise ValueError("No stake registered")
+        self.addresses = [address for address, _ in stakes]
+        self.stakes = [stake for _, stake in stakes]
+        self.probability, self.alias = self._build_alias_table(self.stakes)
+
+    @staticmethod
+    def _build_alias_table(stakes: List[float]):
+        # Vose's alias method: O(n) to build, O(1) per weighted draw.
+        count = len(stakes)
+        total = sum(stakes)
+        scaled = [stake * count / total for stake in stakes]
+        probability = [1.0] * count
+        alias = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            low, high = small.pop(), large.pop()
+            probability[low] = scaled[low]
+            alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            (small if scaled[high] < 1.0 else large).append(high)
+        return probability, alias
+
+    def draw(self, column: int, coin: float) -> str:
+        column %= len(self.addresses)
+        if coin < self.probability[column]:
+            return self.addresses[column]
+        return self.addresses[self.alias[column]]
+
+    def to_dict(self) -> dict:
+        return {'addresses': self.addresses, 'stakes': self.stakes}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'StakeSnapshot':
+        return cls(list(zip(data['addresses'], data['stakes'])))
+
+
+class EpochSchedule:
+    """Proposer for each slot of one epoch; proposer() is a list lookup."""
+
+    def __init__(self, epoch: int, slots_per_epoch: int, seed: bytes, snapshot: StakeSnapshot):
+        self.epoch = epoch
+        self.slots_per_epoch = slots_per_epoch
+        self.first_slot = epoch * slots_per_epoch
+        self.seed = seed
+        self.snapshot = snapshot
+        self.proposers = [self._draw(slot) for slot in range(slots_per_epoch)]
+
+    def _draw(self, slot: int) -> str:
+        digest = hashlib.sha256(self.seed + struct.pack('>Q', slot)).digest()
+        column, coin = SLOT_DRAW.unpack_from(digest)
+        return self.snapshot.draw(column, coin / 2 ** 64)
+
+    def __contains__(self, slot: int) -> bool:
+        return self.first_slot <= slot < self.first_slot + self.slots_per_epoch
+
+    def proposer(self, slot: int) -> str:
+        if slot not in self:
+            raise IndexError(f"Slot {slot} is not in epoch {self.epoch}")
+        return self.proposers[slot - self.first_slot]
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({
+                'epoch': self.epoch,
+                'slots_per_epoch': self.slots_per_epoch,
+                'seed': self.seed.hex(),
+                'snapshot': self.snapshot.to_dict()
+            }, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'EpochSchedule':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return cls(data['epoch'], data['slots_per_epoch'], bytes.fromhex(data['seed']),
+                   StakeSnapshot.from_dict(data['snapshot']))
+
+
+def epoch_seed(block_hash: str, epoch: int) -> bytes:
+    return hashlib.sha256(bytes.fromhex(block_hash) + struct.pack('>Q', epoch)).digest()
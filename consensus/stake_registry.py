@@ -0,0 +1,93 @@
+import random
+from typing import Dict, Iterator, Optional, Tuple
+
+
+class StakeRegistry:
+    """Stake per wallet address, backed by a Fenwick (binary indexed) tree.
+
+    Stake updates and stake-weighted draws are both O(log n). Every address
+    keeps the slot it was first given, so draws are reproducible for a given
+    sequence of updates and random generator state.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = 1
+        while self._capacity < capacity:
+            self._capacity *= 2
+        self._tree = [0.0] * (self._capacity + 1)  # 1-based Fenwick tree
+        self._stakes = []     # slot -> stake
+        self._addresses = []  # slot -> wallet address
+        self._slots: Dict[str, int] = {}  # wallet address -> slot
+        self.total = 0.0
+
+    def __len__(self) -> int:
+        return len(self._addresses)
+
+    def __contains__(self, wallet_address: str) -> bool:
+        return wallet_address in self._slots
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        return zip(self._addresses, self._stakes)
+
+    def stake_of(self, wallet_address: str) -> float:
+        slot = self._slots.get(wallet_address)
+        return self._stakes[slot] if slot is not None else 0.0
+
+    def add_stake(self, wallet_address: str, amount: float):
+        slot = self._slots.get(wallet_address)
+        if slot is None:
+            slot = self._new_slot(wallet_address)
+        if self._stakes[slot] + amount < 0:
+            raise ValueError(f"Stake of {wallet_address} cannot go negative")
+        self._stakes[slot] += amount
+        self.total += amount
+        self._add(slot, amount)
+
+    def set_stake(self, wallet_address: str, amount: float):
+        self.add_stake(wallet_address, amount - self.stake_of(wallet_address))
+
+    def _new_slot(self, wallet_address: str) -> int:
+        slot = len(self._addresses)
+        self._addresses.append(wallet_address)
+        self._stakes.append(0.0)
+        self._slots[wallet_address] = slot
+        if slot >= self._capacity:
+            self._grow()
+        return slot
+
+    def _grow(self):
+        # Doubling keeps growth amortised O(1); the tree is rebuilt in O(n).
+        self._capacity *= 2
+        tree = [0.0] * (self._capacity + 1)
+        for slot, stake in enumerate(self._stakes, 1):
+            tree[slot] += stake
+            parent = slot + (slot & -slot)
+            if parent <= self._capacity:
+                tree[parent] += tree[slot]
+        self._tree = tree
+
+    def _add(self, slot: int, amount: float):
+        i = slot + 1
+        tree, capacity = self._tree, self._capacity
+        while i <= capacity:
+            tree[i] += amount
+            i += i & -i
+
+    def find(self, point: float) -> str:
+        """Address whose cumulative stake interval contains point (0 <= point < total)."""
+        if not self._addresses or self.total <= 0:
+            raise ValueError("No stake registered")
+        # Descend the implicit tree: largest prefix whose sum is <= point.
+        position, step, tree = 0, self._capacity, self._tree
+        while step:
+            following = position + step
+            if following <= self._capacity and tree[following] <= point:
+                position = following
+                point -= tree[following]
+            step >>= 1
+        # Float rounding can push a draw at the very top past the last slot.
+        return self._addresses[min(position, len(self._addresses) - 1)]
+
+    def sample(self, rng: Optional[random.Random] = None) -> str:
+        """Draw an address with probability proportional to its stake."""
+        return self.find((rng or random).random() * self.total)
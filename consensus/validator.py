@@ -0,0 +1,128 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+from storage.block_store import BlockStore
+from consensus.miner import DEFAULT_DIFFICULTY_BITS
+
+GENESIS_PREVIOUS_HASH = "0"
+
+
+def check_block(block, previous_hash: str, difficulty_bits: int, genesis: bool = False) -> Optional[str]:
+    """Return why block is invalid as a successor of previous_hash, or None if it's fine."""
+    if block.previous_hash != previous_hash:
+        return "previous hash does not link to the chain"
+    if block.hash != block.calculate_hash():
+        return "hash does not match header"
+    if not genesis and not block.meets_target(difficulty_bits):
+        return "hash does not meet the difficulty target"
+    if block.calculate_merkle_root() != block.merkle_root:
+        return "merkle root does not match chunks"
+    return None
+
+
+def validate_range(data_dir: str, decode: Callable, start: int, stop: int, difficulty_bits: int):
+    """Check blocks [start, stop) of the store in data_dir.
+
+    Runs in a worker process. The link into the range is checked against the
+    hash recorded in the height index, which the neighbouring range in turn
+    checks against the actual block. Returns (height, reason) for the first
+    bad block, or None.
+    """
+    store = BlockStore(data_dir, read_only=True)
+    try:
+        previous_hash = store.hash_at(start - 1).hex() if start else GENESIS_PREVIOUS_HASH
+        for height in range(start, stop):
+            block = decode(store.get(height))
+            reason = check_block(block, previous_hash, difficulty_bits, genesis=height == 0)
+            if reason is None and store.hash_at(height).hex() != block.hash:
+                reason = "height index records a different hash"
+            if reason is not None:
+                return height, reason
+            previous_hash = block.hash
+        return None
+    finally:
+        store.close()
+
+
+class ValidationReport:
+    def __init__(self, start: int, stop: int, invalid_height: Optional[int] = None,
+                 reason: Optional[str] = None):
+        self.start = start  # first height that was re-verified
+        self.stop = stop    # chain length at the time of the check
+        self.invalid_height = invalid_height
+        self.reason = reason
+
+    @property
+    def valid(self) -> bool:
+        return self.invalid_height is None
+
+
+class ChainValidator:
+    """Verifies a stored chain in parallel, resuming from the last checkpoint.
+
+    The unverified part of the chain is split into ranges that worker
+    processes check independently. When everything passes, the tip is
+    recorded as a trusted checkpoint, so the next start only covers blocks
+    appended since.
+    """
+
+    def __init__(self, data_dir: str, decode: Callable, difficulty_bits: int = DEFAULT_DIFFICULTY_BITS,
+                 workers: Optional[int] = None, range_size: int = 2048):
+        self.data_dir = data_dir
+        self.decode = decode
+        self.difficulty_bits = difficulty_bits
+        self.workers = workers or os.cpu_count() or 1
+        self.range_size = range_size
+        self.checkpoints_path = os.path.join(data_dir, 'checkpoints.json')
+        self.max_checkpoints = 16
+
+    def load_checkpoints(self) -> list:
+        if not os.path.exists(self.checkpoints_path):
+            return []
+        with open(self.checkpoints_path, 'r') as f:
+            return json.load(f)
+
+    def save_checkpoint(self, height: int, block_hash: str):
+        checkpoints = [c for c in self.load_checkpoints() if c['height'] < height]
+        checkpoints.append({'height': height, 'hash': block_hash})
+        checkpoints = checkpoints[-self.max_checkpoints:]
+        tmp_path = self.checkpoints_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoints, f, indent=4)
+        os.replace(tmp_path, self.checkpoints_path)
+
+    def resume_height(self, store: BlockStore) -> int:
+        """First height after the newest checkpoint that still matches the store."""
+        for checkpoint in reversed(self.load_checkpoints()):
+            height = checkpoint['height']
+            if height < len(store) and store.hash_at(height).hex() == checkpoint['hash']:
+                return height + 1
+        return 0
+
+    def verify(self, store: BlockStore) -> ValidationReport:
+        """Verify store (already open in this process) and checkpoint its tip."""
+        store.flush()  # workers open their own read-only view of the files
+        start, stop = self.resume_height(store), len(store)
+        ranges = [(begin, min(begin + self.range_size, stop))
+                  for begin in range(start, stop, self.range_size)]
+        if not ranges:
+            return ValidationReport(start, stop)
+
+        failure = None
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(ranges))) as pool:
+            futures = [pool.submit(validate_range, self.data_dir, self.decode,
+                                   begin, end, self.difficulty_bits)
+                       for begin, end in ranges]
+            # Collected in chain order, so the first failure seen is the lowest.
+            for future in futures:
+                failure = future.result()
+                if failure is not None:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+        if failure is not None:
+            return ValidationReport(start, stop, *failure)
+        self.save_checkpoint(stop - 1, store.hash_at(stop - 1).hex())
+        return ValidationReport(start, stop)
@@ -0,0 +1,8 @@
+from cryptography.hazmat.primitives import serialization
+
+
+def load_public_key(key_data: bytes):
+    """Load an RSA public key stored as either PEM or DER."""
+    if key_data.lstrip().startswith(b'-----'):
+        return serialization.load_pem_public_key(key_data)
+    return serialization.load_der_public_key(key_data)
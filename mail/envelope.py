@@ -0,0 +1,54 @@
+import struct
+from typing import List, Tuple
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from crypto.keys import load_public_key
+
+# Hybrid encryption: each message gets a random AES-256-GCM content key,
+# wrapped once with the recipient's RSA key (the "envelope"). The message is
+# then sealed chunk by chunk; chunk i uses nonce i, so chunks can be opened
+# independently and in any order, but can't be reordered undetected. The
+# associated data binds every chunk to its recipient, message id and chunk
+# count, so chunks can't be moved between messages or a message truncated.
+
+CONTENT_KEY_BITS = 256
+CHUNK_NONCE = struct.Struct('>4xQ')  # 12-byte GCM nonce: zero pad + chunk index
+CHUNK_AD = struct.Struct('>16sI')    # message id, total chunks
+
+OAEP = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+
+def chunk_associated_data(recipient_address: str, message_id: str, total_chunks: int) -> bytes:
+    return CHUNK_AD.pack(bytes.fromhex(message_id), total_chunks) + recipient_address.encode('utf-8')
+
+
+def chunk_count(content_length: int, chunk_size: int) -> int:
+    # An empty message still gets one (empty) chunk.
+    return max(1, -(-content_length // chunk_size))
+
+
+def seal_message(public_key, content: bytes, chunk_size: int, associated_data: bytes) -> Tuple[bytes, List[bytes]]:
+    """Encrypt content for public_key; returns (envelope, chunk ciphertexts)."""
+    content_key = AESGCM.generate_key(bit_length=CONTENT_KEY_BITS)
+    envelope = public_key.encrypt(content_key, OAEP)
+    aead = AESGCM(content_key)
+    view = memoryview(content)
+    ciphertexts = [
+        aead.encrypt(CHUNK_NONCE.pack(index), view[offset:offset + chunk_size], associated_data)
+        for index, offset in enumerate(range(0, len(content) or 1, chunk_size))
+    ]
+    return envelope, ciphertexts
+
+
+def open_envelope(private_key, envelope: bytes) -> AESGCM:
+    """Unwrap a message's content key; this is the only RSA operation per message."""
+    return AESGCM(private_key.decrypt(envelope, OAEP))
+
+
+def open_chunk(aead: AESGCM, index: int, ciphertext: bytes, associated_data: bytes) -> bytes:
+    return aead.decrypt(CHUNK_NONCE.pack(index), ciphertext, associated_data)
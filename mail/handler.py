@@ -0,0 +1,193 @@
+from typing import List, Optional
+import base64
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from storage.recipient_index import RecipientIndex
+from mail.envelope import open_envelope, open_chunk, chunk_associated_data
+from mail.reassembly import StreamingReassembler
+
+class DecryptionFailure:
+    def __init__(self, chunk, error: Exception):
+        # (message_id, chunk_id) names the chunk wherever it was decrypted;
+        # an index into one batch means nothing once batches are merged.
+        self.position = (chunk.message_id, chunk.chunk_id)
+        self.chunk = chunk
+        self.error = error
+
+    def __repr__(self):
+        return f"DecryptionFailure(message_id={self.position[0]}, chunk_id={self.position[1]}, error={self.error!r})"
+
+class DecryptionResult:
+    """Outcome of a batch decrypt: plaintexts in input order, None where it failed."""
+
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+        self.contents: List[Optional[bytes]] = [None] * len(chunks)
+        self.failures: List[DecryptionFailure] = []
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def decrypted(self):
+        for chunk, content in zip(self.chunks, self.contents):
+            if content is not None:
+                yield chunk, content
+
+class EmailHandler:
+    def __init__(self, blockchain, wallet, recipient_index: RecipientIndex = None,
+                 decrypt_workers: Optional[int] = None, decrypt_batch_size: int = 64,
+                 reassembly_budget: int = 64 * 1024 * 1024):
+        self.blockchain = blockchain
+        self.wallet = wallet
+        if recipient_index is None:
+            recipient_index = RecipientIndex(':memory:')
+            recipient_index.attach(blockchain)
+        self.recipient_index = recipient_index
+        self.message_keys = OrderedDict()  # envelope -> unwrapped AES-GCM key
+        self.message_key_cache_size = 256
+        self._message_keys_lock = threading.Lock()
+        self.decrypt_failures: List[DecryptionFailure] = []  # from the last retrieve
+        # OpenSSL releases the GIL, so decryption threads run on separate cores.
+        self.decrypt_batch_size = decrypt_batch_size
+        self.decrypt_pool = ThreadPoolExecutor(max_workers=decrypt_workers or os.cpu_count())
+        # Drives whole retrieves for callers (e.g. the GUI) that must not block;
+        # kept apart from decrypt_pool so it never waits on its own workers.
+        self._retrieve_pool = ThreadPoolExecutor(max_workers=1)
+        # Outlives a single retrieve: a message's remaining chunks may only
+        # show up in later blocks.
+        self.reassembler = StreamingReassembler(reassembly_budget)
+
+    def located_chunk_batches(self, locations, batch_size: int = 1024):
+        """((height, position), chunk) pairs for sorted locations, in batches."""
+        batch = []
+        block_height, block = None, None
+        # Locations come in chain order, so each block is decoded once.
+        for height, position in locations:
+            if height != block_height:
+                block_height, block = height, self.blockchain.chain[height]
+            batch.append(((height, position), block.email_chunks[position]))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def new_chunk_batches(self, wallet_address: str, batch_size: int = 1024):
+        """Chunks for wallet_address appended since the previous poll, in batches."""
+        for batch in self.located_chunk_batches(self.recipient_index.poll(wallet_address), batch_size):
+            yield [chunk for _, chunk in batch]
+
+    def new_chunks(self, wallet_address: str):
+        """Chunks for wallet_address appended since the previous call."""
+        return [chunk for batch in self.new_chunk_batches(wallet_address) for chunk in batch]
+
+    def retrieve_emails(self, wallet_address: str) -> List[dict]:
+        # Decrypt and reassemble batch by batch so only one batch of
+        # plaintext plus the reassembler's budget is held at a time.
+        # Parts of messages the reassembler had to evict last time are read
+        # again first; the poll cursor has already moved past them.
+        emails = []
+        self.decrypt_failures = []
+        batches = itertools.chain(
+            self.located_chunk_batches(self.reassembler.take_evicted()),
+            self.located_chunk_batches(self.recipient_index.poll(wallet_address)))
+        for batch in batches:
+            locations = [location for location, _ in batch]
+            result = self.decrypt_batch([chunk for _, chunk in batch], self.wallet.private_key)
+            self.decrypt_failures.extend(result.failures)
+            emails.extend(self.reconstruct_emails([{
+                'content': decrypted_content,
+                'timestamp': chunk.timestamp,
+                'chunk_id': chunk.chunk_id,
+                'message_id': chunk.message_id,
+                'total_chunks': chunk.total_chunks,
+                'location': location
+            } for location, chunk, decrypted_content in zip(locations, result.chunks, result.contents)
+                if decrypted_content is not None]))
+
+        return emails
+
+    def retrieve_emails_async(self, wallet_address: str) -> Future:
+        """Run retrieve_emails in the background; the Future yields its result."""
+        return self._retrieve_pool.submit(self.retrieve_emails, wallet_address)
+
+    def decrypt_batch(self, chunks: list, private_key) -> DecryptionResult:
+        """Decrypt chunks on the worker pool, keeping their order."""
+        result = DecryptionResult(chunks)
+
+        # Unwrap each distinct envelope once, in parallel, before any chunk
+        # work starts, so no two workers race to unwrap the same key.
+        envelopes = list({bytes(chunk.envelope) for chunk in chunks})
+        keys = dict(zip(envelopes, self.decrypt_pool.map(
+            lambda envelope: self._try(self.message_key, envelope, private_key), envelopes)))
+
+        def open_range(start: int):
+            opened = []
+            for chunk in chunks[start:start + self.decrypt_batch_size]:
+                aead = keys[bytes(chunk.envelope)]
+                if isinstance(aead, Exception):
+                    opened.append(aead)
+                else:
+                    opened.append(self._try(open_chunk, aead, chunk.chunk_id, chunk.encrypted_content,
+                                            self._associated_data(chunk)))
+            return opened
+
+        # Chunks are handed out in ranges; one task per 16 KiB chunk would
+        # spend more time in the executor than in AES.
+        starts = range(0, len(chunks), self.decrypt_batch_size)
+        for start, opened in zip(starts, self.decrypt_pool.map(open_range, starts)):
+            for position, content in enumerate(opened, start):
+                if isinstance(content, Exception):
+                    result.failures.append(DecryptionFailure(chunks[position], content))
+                else:
+                    result.contents[position] = content
+        return result
+
+    @staticmethod
+    def _try(function, *args):
+        try:
+            return function(*args)
+        except Exception as e:
+            return e
+
+    def message_key(self, envelope: bytes, private_key):
+        # Every chunk of a message carries the same envelope, so the RSA
+        # unwrap happens once per message rather than once per chunk.
+        envelope = bytes(envelope)
+        with self._message_keys_lock:
+            aead = self.message_keys.get(envelope)
+            if aead is not None:
+                self.message_keys.move_to_end(envelope)
+                return aead
+        aead = open_envelope(private_key, envelope)
+        with self._message_keys_lock:
+            self.message_keys[envelope] = aead
+            if len(self.message_keys) > self.message_key_cache_size:
+                self.message_keys.popitem(last=False)
+        return aead
+
+    def decrypt_chunk(self, chunk, private_key):
+        aead = self.message_key(chunk.envelope, private_key)
+        return open_chunk(aead, chunk.chunk_id, chunk.encrypted_content,
+                          self._associated_data(chunk))
+
+    @staticmethod
+    def _associated_data(chunk) -> bytes:
+        return chunk_associated_data(chunk.recipient_address, chunk.message_id, chunk.total_chunks)
+
+    def reconstruct_emails(self, chunks: List[dict]) -> List[dict]:
+        # Feed decrypted chunks to the reassembler; emails complete as soon as
+        # their last missing chunk arrives, wherever it lands in the stream.
+        complete_emails = []
+        for chunk in chunks:
+            email = self.reassembler.add(chunk['message_id'], chunk['chunk_id'],
+                                         chunk['total_chunks'], chunk['content'],
+                                         chunk['timestamp'], chunk.get('location'))
+            if email is not None:
+                complete_emails.append(email)
+
+        return complete_emails
\ No newline at end of file
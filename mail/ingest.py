@@ -0,0 +1,100 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from typing import List, Optional
+
+
+class MailIngest:
+    """Turns mail accepted over SMTP into encrypted chunks in the mempool.
+
+    Parsing, key lookup and encryption run on a thread pool, so the SMTP
+    event loop keeps serving other sessions. Messages being ingested are
+    capped by count and by bytes; past either cap new mail is deferred
+    with a 451 so senders retry later instead of growing memory without
+    bound.
+    """
+
+    def __init__(self, protocol, max_inflight_messages: int = 64,
+                 max_inflight_bytes: int = 64 * 1024 * 1024, workers: Optional[int] = None):
+        self.protocol = protocol
+        self.max_inflight_messages = max_inflight_messages
+        self.max_inflight_bytes = max_inflight_bytes
+        self.inflight_messages = 0
+        self.inflight_bytes = 0
+        self._lock = threading.Lock()
+        # OpenSSL releases the GIL, so encryption threads run on separate cores.
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self._parser = BytesParser(policy=policy.default)
+
+        self.queued = 0
+        self.deferred = 0
+        self.rejected = 0
+
+    def saturated(self) -> bool:
+        with self._lock:
+            return (self.inflight_messages >= self.max_inflight_messages or
+                    self.inflight_bytes >= self.max_inflight_bytes)
+
+    def reserve(self, size: int) -> bool:
+        with self._lock:
+            # A lone message is always let through, however big, so a
+            # message above max_inflight_bytes isn't deferred forever.
+            if self.inflight_messages and (
+                    self.inflight_messages >= self.max_inflight_messages or
+                    self.inflight_bytes + size > self.max_inflight_bytes):
+                self.deferred += 1
+                return False
+            self.inflight_messages += 1
+            self.inflight_bytes += size
+            return True
+
+    def release(self, size: int):
+        with self._lock:
+            self.inflight_messages -= 1
+            self.inflight_bytes -= size
+
+    async def ingest(self, recipients: List[str], data: bytes) -> str:
+        """Queue data for every recipient; returns the SMTP reply for DATA."""
+        size = len(data)
+        if not self.reserve(size):
+            return '451 Too much mail in flight, try again later'
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, self._process, list(recipients), data)
+        except Exception as e:
+            print(f"Failed to queue message for {recipients}: {e}")
+            return '451 Could not queue message, try again later'
+        finally:
+            self.release(size)
+
+    def _process(self, recipients: List[str], data: bytes) -> str:
+        message = self._parser.parsebytes(data, headersonly=True)
+        if not message.keys():
+            self.rejected += 1
+            return '554 Message has no headers'
+        # One query for all recipients; encrypt_message then hits the key cache.
+        keys = self.protocol.wallet_resolver.get_keys(recipients)
+        unknown = [address for address in recipients if address not in keys]
+        if unknown:
+            self.rejected += 1
+            return f'550 Unknown recipient wallet {unknown[0]}'
+        # The whole message, headers included, is what recipients decrypt.
+        message_ids = [self.protocol.send_email(None, address, data) for address in recipients]
+        self.queued += 1
+        return f'250 OK queued as {" ".join(message_ids)}'
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'inflight_messages': self.inflight_messages,
+                'inflight_bytes': self.inflight_bytes,
+                'queued': self.queued,
+                'deferred': self.deferred,
+                'rejected': self.rejected
+            }
+
+    def close(self):
+        self.pool.shutdown(wait=True)
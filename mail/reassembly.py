@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class PartialMessage:
+    def __init__(self, total_chunks: int, timestamp):
+        self.total_chunks = total_chunks
+        self.timestamp = timestamp
+        self.parts = {}  # chunk index -> plaintext
+        self.size = 0
+        self.locations = []  # where the parts were read from, for refetching
+
+
+class StreamingReassembler:
+    """Collects decrypted chunks by message id and emits each message once complete.
+
+    Chunks may arrive in any order and spread over many blocks or polls.
+    Partial messages are kept in least-recently-updated order; when the
+    buffered plaintext exceeds max_buffered_bytes the stalest ones are
+    dropped and counted in `evicted`. The locations of a dropped message's
+    parts are kept so the caller can read them again (take_evicted) and
+    feed them back once there is room; only a message too big for the whole
+    budget is given up on.
+    """
+
+    def __init__(self, max_buffered_bytes: int = 64 * 1024 * 1024):
+        self.max_buffered_bytes = max_buffered_bytes
+        self.pending = OrderedDict()  # message_id -> PartialMessage
+        self.buffered_bytes = 0
+        self.completed = 0
+        self.evicted = 0
+        self.dropped = 0  # evicted messages that could never fit
+        self._refetch: Dict[str, list] = {}  # message_id -> locations of evicted parts
+
+    def add(self, message_id: str, index: int, total_chunks: int, content: bytes,
+            timestamp=None, location=None) -> Optional[dict]:
+        """Buffer one chunk; returns the finished email when this chunk completes it."""
+        if not 0 <= index < total_chunks:
+            return None
+        message = self.pending.get(message_id)
+        if message is None:
+            message = self.pending[message_id] = PartialMessage(total_chunks, timestamp)
+        elif message.total_chunks != total_chunks or index in message.parts:
+            return None
+        self.pending.move_to_end(message_id)
+        if timestamp is not None and (message.timestamp is None or timestamp < message.timestamp):
+            message.timestamp = timestamp
+
+        message.parts[index] = content
+        message.size += len(content)
+        if location is not None:
+            message.locations.append(location)
+        self.buffered_bytes += len(content)
+
+        if len(message.parts) == message.total_chunks:
+            del self.pending[message_id]
+            self.buffered_bytes -= message.size
+            self.completed += 1
+            # Decode once over the joined bytes: a multi-byte character may
+            # straddle a chunk boundary.
+            content = b''.join(message.parts[i] for i in range(message.total_chunks))
+            return {
+                'message_id': message_id,
+                'content': content.decode('utf-8', errors='replace'),
+                'timestamp': message.timestamp
+            }
+
+        self._evict()
+        return None
+
+    def _evict(self):
+        while self.buffered_bytes > self.max_buffered_bytes and self.pending:
+            message_id, message = self.pending.popitem(last=False)
+            self.buffered_bytes -= message.size
+            self.evicted += 1
+            expected_size = message.size / len(message.parts) * message.total_chunks
+            if expected_size > self.max_buffered_bytes:
+                self.dropped += 1
+                self._refetch.pop(message_id, None)
+            else:
+                self._refetch.setdefault(message_id, []).extend(message.locations)
+
+    def take_evicted(self) -> List:
+        """Locations of every evicted part not yet handed out, in sorted order."""
+        refetch, self._refetch = self._refetch, {}
+        return sorted(location for locations in refetch.values() for location in locations)
@@ -0,0 +1,116 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from aiosmtpd.controller import Controller
+from mail.ingest import MailIngest
+
+# Base32 addresses from client.core.wallet_manager.Wallet, or the hex
+# SHA-256 addresses of the node's own blockchain.Wallet.
+WALLET_ADDRESS = re.compile(r'[A-Z2-7]{40}|[0-9a-f]{64}')
+
+class RecipientLookup:
+    """Resolves RCPT addresses against the WalletResolver in batches.
+
+    Lookups from every session are queued; one get_keys query answers all
+    that arrived while the previous query ran, so a burst of RCPTs costs a
+    few queries rather than one per address. get_keys caches keys and
+    unknown addresses, so repeat recipients rarely reach SQLite at all.
+    """
+
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self._pending = {}  # wallet address -> futures waiting on it
+        self._draining = False
+        # Kept apart from the ingest pool so lookups don't queue behind encryption.
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.lookups = 0
+
+    async def exists(self, wallet_address: str) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(wallet_address, []).append(future)
+        if not self._draining:
+            self._draining = True
+            loop.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        try:
+            await asyncio.sleep(0)  # let RCPTs from the same loop pass join in
+            while self._pending:
+                pending, self._pending = self._pending, {}
+                self.batches += 1
+                self.lookups += len(pending)
+                try:
+                    keys = await asyncio.get_running_loop().run_in_executor(
+                        self._pool, self.resolver.get_keys, list(pending))
+                except Exception as e:
+                    for futures in pending.values():
+                        for future in futures:
+                            if not future.done():
+                                future.set_exception(e)
+                    continue
+                for address, futures in pending.items():
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(address in keys)
+        finally:
+            self._draining = False
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+class EmailBlockchainSMTP:
+    """aiosmtpd handler: checks recipient wallets and hands DATA to the ingest pipeline."""
+
+    def __init__(self, ingest: MailIngest, lookup: RecipientLookup):
+        self.ingest = ingest
+        self.lookup = lookup
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        # The wallet is the local part; any domain is accepted.
+        wallet_address = address.split('@', 1)[0]
+        if not self.is_valid_blockchain_address(wallet_address):
+            return '550 Invalid blockchain email address'
+        if wallet_address in envelope.rcpt_tos:
+            return '250 OK'
+        # Deferring here saves the sender transmitting a body we'd refuse.
+        if self.ingest.saturated():
+            return '451 Too much mail in flight, try again later'
+        try:
+            known = await self.lookup.exists(wallet_address)
+        except Exception as e:
+            print(f"Recipient lookup failed for {wallet_address}: {e}")
+            return '451 Could not look up recipient, try again later'
+        if not known:
+            return '550 Unknown recipient wallet'
+        envelope.rcpt_tos.append(wallet_address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        return await self.ingest.ingest(envelope.rcpt_tos, envelope.original_content)
+
+    def is_valid_blockchain_address(self, address: str) -> bool:
+        return WALLET_ADDRESS.fullmatch(address) is not None
+
+class BlockchainEmailServer:
+    def __init__(self, protocol, host='127.0.0.1', port=8025, max_message_bytes=32 * 1024 * 1024,
+                 max_inflight_messages=64, max_inflight_bytes=64 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.ingest = MailIngest(protocol, max_inflight_messages, max_inflight_bytes)
+        self.lookup = RecipientLookup(protocol.wallet_resolver)
+        # aiosmtpd buffers a whole DATA section before handing it over, so
+        # max_message_bytes also bounds what one session can hold in memory.
+        self.controller = Controller(EmailBlockchainSMTP(self.ingest, self.lookup), hostname=host,
+                                     port=port, data_size_limit=max_message_bytes)
+
+    def start(self):
+        self.controller.start()
+        print(f"SMTP server running on {self.host}:{self.port}")
+
+    def stop(self):
+        self.controller.stop()
+        self.lookup.close()
+        self.ingest.close()
@@ -0,0 +1,107 @@
+import datetime
+import struct
+from typing import List, Tuple
+from consensus.header import HEADER_SIZE
+
+# Binary encoding of blocks and chunks for the wire and the block store.
+#
+#   block: codec version (1) | hash (32) | header (84) | chunk count (4) | chunks
+#   chunk: CHUNK_HEADER | recipient | envelope | encrypted content
+#
+# Decoding is zero-copy: chunk envelopes and ciphertexts are memoryview
+# slices of the buffer being decoded, so a decoded block keeps that buffer
+# alive for as long as its chunks are referenced.
+
+CODEC_VERSION = 1
+BLOCK_PREAMBLE = struct.Struct('>B32s')
+CHUNK_COUNT = struct.Struct('>I')
+# chunk id, total chunks, message id, timestamp, recipient/envelope/content lengths
+CHUNK_HEADER = struct.Struct('>II16sdHII')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def encode_chunk(chunk, parts: List[bytes]):
+    recipient = chunk.recipient_address.encode('utf-8')
+    parts.append(CHUNK_HEADER.pack(chunk.chunk_id, chunk.total_chunks,
+                                   bytes.fromhex(chunk.message_id),
+                                   chunk.timestamp.timestamp(),
+                                   len(recipient), len(chunk.envelope),
+                                   len(chunk.encrypted_content)))
+    parts.append(recipient)
+    parts.append(chunk.envelope)
+    parts.append(chunk.encrypted_content)
+
+
+def decode_chunk(view: memoryview, offset: int) -> Tuple[object, int]:
+    from blockchain import EmailChunk  # blockchain imports the network package
+    try:
+        (chunk_id, total_chunks, message_id, timestamp,
+         recipient_length, envelope_length, content_length) = CHUNK_HEADER.unpack_from(view, offset)
+    except struct.error as e:
+        raise CodecError(f"Truncated chunk: {e}")
+    offset += CHUNK_HEADER.size
+    end = offset + recipient_length + envelope_length + content_length
+    if end > len(view):
+        raise CodecError("Chunk runs past the end of the buffer")
+    recipient = str(view[offset:offset + recipient_length], 'utf-8')
+    offset += recipient_length
+    envelope = view[offset:offset + envelope_length]
+    offset += envelope_length
+    chunk = EmailChunk(chunk_id, view[offset:end], recipient, envelope,
+                       message_id.hex() if any(message_id) else '', total_chunks)
+    try:
+        chunk.timestamp = datetime.datetime.fromtimestamp(timestamp)
+    except (OverflowError, OSError, ValueError) as e:
+        raise CodecError(f"Invalid chunk timestamp {timestamp}: {e}")
+    return chunk, end
+
+
+def encode_block(block) -> bytes:
+    parts = [BLOCK_PREAMBLE.pack(CODEC_VERSION, bytes.fromhex(block.hash)),
+             block.serialize_header(),
+             CHUNK_COUNT.pack(len(block.email_chunks))]
+    for chunk in block.email_chunks:
+        encode_chunk(chunk, parts)
+    return b''.join(parts)
+
+
+def decode_block(buffer, offset: int = 0) -> Tuple[object, int]:
+    """Decode the block at offset in buffer; returns (block, offset after it)."""
+    from blockchain import Block  # blockchain imports the network package
+    view = memoryview(buffer)
+    try:
+        version, block_hash = BLOCK_PREAMBLE.unpack_from(view, offset)
+        if version != CODEC_VERSION:
+            raise CodecError(f"Unknown block encoding version {version}")
+        offset += BLOCK_PREAMBLE.size
+        header = view[offset:offset + HEADER_SIZE]
+        offset += HEADER_SIZE
+        count, = CHUNK_COUNT.unpack_from(view, offset)
+        offset += CHUNK_COUNT.size
+        chunks = []
+        for _ in range(count):
+            chunk, offset = decode_chunk(view, offset)
+            chunks.append(chunk)
+    except struct.error as e:
+        raise CodecError(f"Truncated block: {e}")
+    return Block.from_header_fields(header, chunks, block_hash=block_hash.hex()), offset
+
+
+def encode_blocks(blocks: List) -> bytes:
+    return CHUNK_COUNT.pack(len(blocks)) + b''.join(encode_block(block) for block in blocks)
+
+
+def decode_blocks(buffer) -> List:
+    view = memoryview(buffer)
+    try:
+        count, = CHUNK_COUNT.unpack_from(view, 0)
+    except struct.error as e:
+        raise CodecError(f"Truncated block list: {e}")
+    offset, blocks = CHUNK_COUNT.size, []
+    for _ in range(count):
+        block, offset = decode_block(view, offset)
+        blocks.append(block)
+    return blocks
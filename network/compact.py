@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from consensus.header import HEADER_PREFIX, HEADER_SIZE
+from consensus.merkle import MerkleTree
+from network.codec import BLOCK_PREAMBLE, CODEC_VERSION, CHUNK_COUNT, CodecError, decode_chunk, encode_chunk
+
+# A compact block is the block hash and header plus a short id per chunk:
+#   codec version (1) | hash (32) | header (84) | salt (8) | count (4) | short ids
+# Short ids are a keyed hash of each chunk's merkle leaf, salted per
+# announcement so nobody can grind chunks whose ids collide on every node.
+
+SHORT_ID_SIZE = 6
+SALT_SIZE = 8
+
+
+def short_id(leaf_hash: bytes, salt: bytes) -> bytes:
+    return hashlib.blake2b(leaf_hash, digest_size=SHORT_ID_SIZE, key=salt).digest()
+
+
+def chunks_key(leaf_hashes: List[bytes]) -> bytes:
+    """Gossip key of a set of chunks."""
+    return hashlib.sha256(b''.join(leaf_hashes)).digest()
+
+
+class CompactBlock:
+    def __init__(self, block_hash: str, header: bytes, salt: bytes, short_ids: List[bytes]):
+        self.hash = block_hash
+        self.header = header
+        self.salt = salt
+        self.short_ids = short_ids
+
+    @classmethod
+    def from_block(cls, block, salt: Optional[bytes] = None) -> 'CompactBlock':
+        salt = salt or os.urandom(SALT_SIZE)
+        return cls(block.hash, block.serialize_header(), salt,
+                   [short_id(leaf, salt) for leaf in block.merkle_tree.levels[0]])
+
+    def encode(self) -> bytes:
+        return b''.join([BLOCK_PREAMBLE.pack(CODEC_VERSION, bytes.fromhex(self.hash)),
+                         self.header, self.salt, CHUNK_COUNT.pack(len(self.short_ids))] +
+                        self.short_ids)
+
+    @classmethod
+    def decode(cls, buffer) -> 'CompactBlock':
+        view = memoryview(buffer)
+        try:
+            version, block_hash = BLOCK_PREAMBLE.unpack_from(view, 0)
+            offset = BLOCK_PREAMBLE.size
+            header = bytes(view[offset:offset + HEADER_SIZE])
+            offset += HEADER_SIZE
+            salt = bytes(view[offset:offset + SALT_SIZE])
+            offset += SALT_SIZE
+            count, = CHUNK_COUNT.unpack_from(view, offset)
+            offset += CHUNK_COUNT.size
+        except struct.error as e:
+            raise CodecError(f"Truncated compact block: {e}")
+        if version != CODEC_VERSION:
+            raise CodecError(f"Unknown block encoding version {version}")
+        if len(view) != offset + count * SHORT_ID_SIZE:
+            raise CodecError("Compact block has the wrong number of short ids")
+        short_ids = [bytes(view[i:i + SHORT_ID_SIZE])
+                     for i in range(offset, len(view), SHORT_ID_SIZE)]
+        return cls(block_hash.hex(), header, salt, short_ids)
+
+
+def encode_chunks(chunks: List) -> bytes:
+    parts = [CHUNK_COUNT.pack(len(chunks))]
+    for chunk in chunks:
+        encode_chunk(chunk, parts)
+    return b''.join(parts)
+
+
+def decode_chunks(buffer) -> List:
+    view = memoryview(buffer)
+    try:
+        count, = CHUNK_COUNT.unpack_from(view, 0)
+    except struct.error as e:
+        raise CodecError(f"Truncated chunk list: {e}")
+    offset, chunks = CHUNK_COUNT.size, []
+    for _ in range(count):
+        chunk, offset = decode_chunk(view, offset)
+        chunks.append(chunk)
+    return chunks
+
+
+class ChunkPool:
+    """Chunks relayed to us that aren't in a block yet, keyed by merkle leaf hash.
+
+    Only used to rebuild compact blocks, never for mining, so chunks gossiped
+    by other nodes can't end up mined twice. Oldest chunks are evicted past
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._chunks = OrderedDict()  # leaf hash -> chunk
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add(self, leaf_hash: bytes, chunk):
+        if leaf_hash in self._chunks:
+            return
+        self._chunks[leaf_hash] = chunk
+        self._bytes += len(chunk.encrypted_content)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._chunks.popitem(last=False)
+            self._bytes -= len(evicted.encrypted_content)
+
+    def remove(self, leaf_hash: bytes):
+        chunk = self._chunks.pop(leaf_hash, None)
+        if chunk is not None:
+            self._bytes -= len(chunk.encrypted_content)
+
+    def by_short_id(self, salt: bytes) -> Dict[bytes, tuple]:
+        # Short ids are salted per block, so the index is rebuilt per block;
+        # it only hashes the 32-byte leaf hashes, not the chunks.
+        return {short_id(leaf, salt): (leaf, chunk) for leaf, chunk in self._chunks.items()}
+
+
+class CompactRelay:
+    """Announces blocks as compact blocks and rebuilds announced ones from the chunk pool.
+
+    Chunks are gossiped as they enter a mempool, so by the time a block is
+    announced its receivers usually hold every chunk and the announcement is
+    little more than the header. Chunks that are missing (or whose short ids
+    collide) are fetched from the announcing peer with get_chunks.
+    """
+
+    def __init__(self, node, blockchain, pool: Optional[ChunkPool] = None):
+        self.node = node
+        self.blockchain = blockchain
+        self.pool = pool or ChunkPool()
+        self.reconstructed = 0
+        self.chunks_requested = 0
+
+        node.register_handler('chunks', self.handle_chunks)
+        node.register_handler('compact_block', self.handle_compact_block)
+        node.register_handler('get_chunks', self.handle_get_chunks)
+        blockchain.subscribe(self.on_block_appended)
+
+    async def gossip_chunks(self, chunks: List):
+        leaves = [chunk.leaf_hash() for chunk in chunks]
+        await self.node.broadcast({'type': 'chunks', 'data': chunks}, key=chunks_key(leaves))
+
+    async def announce(self, block):
+        await self.node.broadcast({'type': 'compact_block', 'data': CompactBlock.from_block(block)},
+                                  key=bytes.fromhex(block.hash))
+
+    async def handle_chunks(self, chunks: List, connection):
+        leaves = [chunk.leaf_hash() for chunk in chunks]
+        for leaf, chunk in zip(leaves, chunks):
+            self.pool.add(leaf, chunk)
+        # Pass them on; the seen-cache stops them coming back.
+        await self.node.broadcast({'type': 'chunks', 'data': chunks}, key=chunks_key(leaves))
+
+    async def handle_get_chunks(self, data, connection) -> Dict:
+        block = self.blockchain.get_block_by_hash(data['hash'])
+        if block is None:
+            raise ValueError(f"Unknown block {data['hash']}")
+        return {'type': 'chunks', 'data': [block.email_chunks[i] for i in data['indexes']]}
+
+    async def handle_compact_block(self, compact: CompactBlock, connection):
+        # Rebuilding may need a get_chunks round trip on this same connection,
+        # whose response the connection can only read once we've returned.
+        asyncio.create_task(self._receive(compact, connection))
+
+    async def _receive(self, compact: CompactBlock, connection):
+        block = await self.reconstruct(compact, connection)
+        if block is not None:
+            self.reconstructed += 1
+            await self.node.handle_new_block(block, connection)
+
+    async def reconstruct(self, compact: CompactBlock, connection):
+        from blockchain import Block  # blockchain imports the network package
+        merkle_root = HEADER_PREFIX.unpack_from(compact.header)[2]
+
+        index = self.pool.by_short_id(compact.salt)
+        found = [index.get(sid) for sid in compact.short_ids]
+        missing = [i for i, entry in enumerate(found) if entry is None]
+        if missing:
+            fetched = await self.fetch_chunks(compact, missing, connection)
+            if fetched is None:
+                return None
+            for i, chunk in zip(missing, fetched):
+                found[i] = (chunk.leaf_hash(), chunk)
+
+        tree = MerkleTree.from_leaves(leaf for leaf, _ in found)
+        if tree.root != merkle_root:
+            # A short id collided with a different pooled chunk: fetch them all.
+            fetched = await self.fetch_chunks(compact, list(range(len(found))), connection)
+            if fetched is None:
+                return None
+            found = [(chunk.leaf_hash(), chunk) for chunk in fetched]
+            tree = MerkleTree.from_leaves(leaf for leaf, _ in found)
+
+        return Block.from_header_fields(compact.header, [chunk for _, chunk in found], tree,
+                                        compact.hash)
+
+    async def fetch_chunks(self, compact: CompactBlock, indexes: List[int], connection) -> Optional[List]:
+        self.chunks_requested += len(indexes)
+        try:
+            response = await connection.request(
+                {'type': 'get_chunks', 'data': {'hash': compact.hash, 'indexes': indexes}})
+        except Exception as e:
+            print(f"Could not fetch chunks of {compact.hash} from {connection.address}: {e}")
+            return None
+        if len(response['data']) != len(indexes):
+            print(f"{connection.address} sent the wrong number of chunks for {compact.hash}")
+            return None
+        return response['data']
+
+    def on_block_appended(self, height: int, block):
+        for leaf in block.merkle_tree.levels[0]:
+            self.pool.remove(leaf)
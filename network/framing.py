@@ -0,0 +1,105 @@
+import asyncio
+import json
+import struct
+from typing import Dict, Optional, Tuple
+from network.codec import decode_block, decode_blocks, encode_block, encode_blocks
+from network.compact import CompactBlock, decode_chunks, encode_chunks
+
+# Every message on a peer connection is one frame:
+#   body length (4) | message type (1) | flags (1) | correlation id (4) | body
+# The body is the message data, binary encoded for block-carrying types and
+# JSON for everything else, preceded by a 32-byte message key (block hash or
+# message id) when FLAG_KEYED is set, so gossip can be deduplicated before
+# the payload is decoded. A request carries a fresh
+# correlation id and its response echoes it, so several requests can be in
+# flight on one connection at once.
+
+FRAME_HEADER = struct.Struct('>IBBI')
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+
+FLAG_REQUEST = 0x01
+FLAG_RESPONSE = 0x02
+FLAG_KEYED = 0x04
+MESSAGE_KEY_SIZE = 32
+
+# Append only: the index of a type is its code on the wire.
+MESSAGE_TYPES = [
+    'ping',
+    'pong',
+    'error',
+    'new_block',
+    'sync_request',
+    'status',
+    'get_headers',
+    'headers',
+    'get_blocks',
+    'blocks',
+    'chunks',
+    'compact_block',
+    'get_chunks',
+    'get_addr',
+    'addr',
+]
+MESSAGE_CODES = {name: code for code, name in enumerate(MESSAGE_TYPES)}
+
+# message type -> (encode, decode) for data that isn't sent as JSON; the
+# decoders slice the received buffer instead of copying chunk payloads
+BINARY_PAYLOADS = {
+    'new_block': (encode_block, lambda payload: decode_block(payload)[0]),
+    'blocks': (encode_blocks, decode_blocks),
+    'chunks': (encode_chunks, decode_chunks),
+    'compact_block': (CompactBlock.encode, CompactBlock.decode),
+}
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_frame(message: Dict, flags: int = 0, correlation_id: int = 0,
+                 key: Optional[bytes] = None) -> bytes:
+    try:
+        code = MESSAGE_CODES[message['type']]
+    except KeyError:
+        raise FrameError(f"Unknown message type {message.get('type')!r}")
+    codec = BINARY_PAYLOADS.get(message['type'])
+    body = codec[0](message['data']) if codec else json.dumps(message.get('data')).encode()
+    if key is not None:
+        if len(key) != MESSAGE_KEY_SIZE:
+            raise FrameError(f"Message key must be {MESSAGE_KEY_SIZE} bytes")
+        flags |= FLAG_KEYED
+        body = key + body
+    if len(body) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(body)} bytes exceeds {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(len(body), code, flags, correlation_id) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, int, Optional[bytes], bytes]:
+    """Read one frame without decoding it.
+
+    Returns (message type code, flags, correlation id, message key or None,
+    payload). Raises asyncio.IncompleteReadError when the peer closes the
+    connection.
+    """
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length, code, flags, correlation_id = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    if code >= len(MESSAGE_TYPES):
+        raise FrameError(f"Unknown message type code {code}")
+    body = await reader.readexactly(length)
+    if not flags & FLAG_KEYED:
+        return code, flags, correlation_id, None, body
+    if length < MESSAGE_KEY_SIZE:
+        raise FrameError("Keyed frame is shorter than its key")
+    return code, flags, correlation_id, body[:MESSAGE_KEY_SIZE], memoryview(body)[MESSAGE_KEY_SIZE:]
+
+
+def decode_message(code: int, payload) -> Dict:
+    message_type = MESSAGE_TYPES[code]
+    codec = BINARY_PAYLOADS.get(message_type)
+    try:
+        data = codec[1](payload) if codec else json.loads(bytes(payload))
+    except ValueError as e:  # CodecError and JSONDecodeError are both ValueErrors
+        raise FrameError(f"Malformed {message_type} payload: {e}")
+    return {'type': message_type, 'data': data}
@@ -1,39 +1,137 @@
-import socket
-import json
-import threading
-from typing import List, Dict
 import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+from network.framing import encode_frame
+from network.peer import DROP_OLDEST, PeerConnection
+from network.seen import SeenCache
 
 class Node:
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, max_queue: int = 256, overflow_policy: str = DROP_OLDEST,
+                 max_inbound: int = 64):
         self.host = host
         self.port = port
-        self.peers: List[tuple] = []
+        self.max_inbound = max_inbound
+        self.max_queue = max_queue  # per-peer outbound frames
+        self.overflow_policy = overflow_policy
+        self.seen = SeenCache()  # keys of gossip already handled or sent
+        self.peers: List[tuple] = []  # outbound peers, best first once a PeerManager ranks them
+        self.peer_manager = None
+        self.connections: Dict[tuple, PeerConnection] = {}  # outbound, one per peer
+        self.inbound = set()
         self.blockchain = None
         self.server = None
+        self.on_new_block = None  # async callback(block)
+        # message type -> async handler(data, connection); a handler's return
+        # value is sent back as the response to a request
+        self.handlers: Dict[str, Callable[..., Awaitable[Optional[Dict]]]] = {
+            'ping': self.handle_ping,
+            'new_block': self.handle_new_block,
+        }
 
     async def start(self):
         self.server = await asyncio.start_server(
             self.handle_connection, self.host, self.port
         )
         print(f"Node listening on {self.host}:{self.port}")
+        for peer in self.peers:
+            self.connect(peer)
+
+    def add_peer(self, host: str, port: int):
+        peer = (host, port)
+        if peer not in self.peers:
+            self.peers.append(peer)
+        if self.server is not None:
+            self.connect(peer)
+
+    def connect(self, peer: tuple) -> PeerConnection:
+        connection = self.connections.get(peer)
+        if connection is None:
+            connection = self.connections[peer] = PeerConnection(
+                self, peer, max_queue=self.max_queue, overflow_policy=self.overflow_policy)
+            connection.start()
+        return connection
+
+    def disconnect(self, peer: tuple):
+        if peer in self.peers:
+            self.peers.remove(peer)
+        connection = self.connections.pop(peer, None)
+        if connection is not None:
+            connection.close()
+
+    def register_handler(self, message_type: str, handler):
+        self.handlers[message_type] = handler
+
+    # Feedback on outbound peers for the peer manager, if there is one.
+
+    def peer_useful(self, peer: tuple, amount: int = 1):
+        if self.peer_manager is not None:
+            self.peer_manager.record_useful(peer, amount)
+
+    def peer_failed(self, peer: tuple):
+        if self.peer_manager is not None:
+            self.peer_manager.record_failure(peer)
+
+    def peer_misbehaved(self, peer: tuple, reason: str):
+        if self.peer_manager is not None:
+            self.peer_manager.record_misbehavior(peer, reason)
 
     async def handle_connection(self, reader, writer):
-        data = await reader.read(1024)
-        message = json.loads(data.decode())
+        if len(self.inbound) >= self.max_inbound:
+            writer.close()
+            return
+        connection = PeerConnection(self, writer.get_extra_info('peername'), reader, writer,
+                                    max_queue=self.max_queue, overflow_policy=self.overflow_policy)
+        self.inbound.add(connection)
+        try:
+            await connection.serve()
+        except asyncio.CancelledError:
+            pass  # server shutting down; asyncio reports cancelled handlers as errors
+        finally:
+            self.inbound.discard(connection)
 
-        if message["type"] == "new_block":
-            await self.handle_new_block(message["data"])
-        elif message["type"] == "sync_request":
-            await self.handle_sync_request(writer)
+    async def dispatch(self, message: Dict, connection: PeerConnection) -> Optional[Dict]:
+        handler = self.handlers.get(message["type"])
+        if handler is None:
+            print(f"Ignoring {message['type']} message from {connection.address}")
+            return None
+        try:
+            return await handler(message["data"], connection)
+        except Exception as e:
+            print(f"Error handling {message['type']} from {connection.address}: {e}")
+            raise
 
-    async def broadcast(self, message: Dict):
-        for peer in self.peers:
-            try:
-                reader, writer = await asyncio.open_connection(peer[0], peer[1])
-                writer.write(json.dumps(message).encode())
-                await writer.drain()
-                writer.close()
-                await writer.wait_closed()
-            except Exception as e:
-                print(f"Failed to broadcast to {peer}: {e}") 
\ No newline at end of file
+    async def handle_ping(self, data, connection) -> Dict:
+        return {'type': 'pong', 'data': data}
+
+    async def handle_new_block(self, block, connection=None):
+        if self.on_new_block:
+            await self.on_new_block(block)
+
+    async def request(self, peer: tuple, message: Dict, timeout: float = 10.0) -> Dict:
+        # Only peers we chose (or the peer manager picked) are dialled; a
+        # dropped or banned peer must not be reconnected by a stray request.
+        if peer not in self.peers:
+            raise ConnectionError(f"{peer} is not one of our peers")
+        return await self.connect(peer).request(message, timeout)
+
+    async def broadcast(self, message: Dict, key: Optional[bytes] = None) -> int:
+        """Queue message for every peer; returns how many queues accepted it.
+
+        Each peer's writer task sends independently, so this never waits on
+        a slow peer. key (a block hash or message id) lets peers drop copies
+        they've already seen; it's recorded here so echoes of it are dropped
+        too.
+        """
+        if key is not None:
+            self.seen.add(key)
+        frame = encode_frame(message, key=key)  # encoded once, shared by every queue
+        return sum(self.connect(peer).send_frame(frame) for peer in self.peers)
+
+    def peer_stats(self) -> Dict[tuple, dict]:
+        return {peer: connection.stats() for peer, connection in self.connections.items()}
+
+    def close(self):
+        for connection in list(self.connections.values()) + list(self.inbound):
+            connection.close()
+        self.connections.clear()
+        if self.server is not None:
+            self.server.close()
@@ -0,0 +1,241 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+from network.framing import (FLAG_REQUEST, FLAG_RESPONSE, FrameError,
+                             decode_message, encode_frame, read_frame)
+
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+STABLE_SESSION = 10.0  # seconds a session must last to reset the reconnect backoff
+
+
+class RemoteError(Exception):
+    """The peer answered a request with an error message."""
+
+
+class PeerConnection:
+    """One long-lived, framed connection to a peer.
+
+    Outbound connections (created with an address) reconnect with
+    exponential backoff whenever the link drops; inbound connections wrap
+    the streams accepted by the node's server and end when the peer hangs
+    up. Incoming frames are passed to node.dispatch().
+
+    Everything sent goes through a bounded outbound queue drained by this
+    connection's own writer task, so a slow peer only delays itself. When
+    the queue is full, the overflow policy either drops the oldest queued
+    frame or resets the connection.
+    """
+
+    def __init__(self, node, address: tuple, reader=None, writer=None,
+                 min_backoff: float = 0.5, max_backoff: float = 30.0,
+                 max_queue: int = 256, overflow_policy: str = DROP_OLDEST):
+        if overflow_policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown overflow policy {overflow_policy!r}")
+        self.node = node
+        self.address = address
+        self.outbound = reader is None
+        self.reader = reader
+        self.writer = writer
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+
+        self.connected = asyncio.Event()
+        if writer is not None:
+            self.connected.set()
+        self._correlation_ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}  # correlation id -> response
+        self._queue = deque()  # (monotonic enqueue time, frame)
+        self._queue_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        self.sent_frames = 0
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.overflow_disconnects = 0
+        self.last_latency = 0.0  # enqueue to flushed, seconds
+        self.average_latency = 0.0  # exponentially weighted
+
+    def start(self):
+        """Keep an outbound connection up in the background."""
+        self._task = asyncio.create_task(self._run())
+        self._start_writer()
+
+    def _start_writer(self):
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._drain())
+
+    async def _run(self):
+        backoff = self.min_backoff
+        while not self._closed:
+            try:
+                self.reader, self.writer = await asyncio.open_connection(*self.address)
+            except OSError as e:
+                print(f"Could not connect to {self.address}: {e}; retrying in {backoff:.1f}s")
+                # Jitter keeps a restarted cluster from reconnecting in lockstep.
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            self.connected.set()
+            started, received = time.monotonic(), self.received_frames
+            await self.serve()
+            if self._closed:
+                break
+            # A peer that accepts and hangs up at once (e.g. it's full) is
+            # retried as patiently as one that refuses; only a session that
+            # carried traffic or lasted a while earns a fast reconnect.
+            if self.received_frames > received or time.monotonic() - started >= STABLE_SESSION:
+                backoff = self.min_backoff
+            await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def serve(self):
+        """Read and dispatch frames until the connection drops."""
+        self._start_writer()
+        try:
+            while True:
+                code, flags, correlation_id, key, payload = await read_frame(self.reader)
+                self.received_frames += 1
+                # Gossip we've already handled is dropped before it's decoded.
+                # Keys are only recorded once a handler accepts the message and
+                # relays it (Node.broadcast), so a bad copy can't shadow good ones.
+                if key is not None and self.node.seen.seen(key):
+                    continue
+                message = decode_message(code, payload)
+                if key is not None and not self._key_matches(key, message):
+                    print(f"Ignoring {message['type']} from {self.address}: key doesn't match its block")
+                    continue
+                if flags & FLAG_RESPONSE:
+                    future = self._pending.pop(correlation_id, None)
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                elif flags & FLAG_REQUEST:
+                    # Requests run concurrently so a slow one doesn't stall the link.
+                    asyncio.create_task(self._answer(message, correlation_id))
+                else:
+                    try:
+                        await self.node.dispatch(message, self)
+                    except Exception:
+                        pass  # reported by the node; one bad message shouldn't drop the link
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except FrameError as e:
+            print(f"Dropping connection to {self.address}: {e}")
+            if self.outbound:
+                self.node.peer_misbehaved(self.address, str(e))
+        finally:
+            self._disconnected()
+            if not self.outbound:
+                self._closed = True
+                self._writer_task.cancel()
+
+    @staticmethod
+    def _key_matches(key: bytes, message: Dict) -> bool:
+        # Blocks and compact blocks are keyed by their hash; other gossip
+        # keys are checked by their handlers when relaying.
+        block_hash = getattr(message['data'], 'hash', None)
+        return block_hash is None or bytes.fromhex(block_hash) == bytes(key)
+
+    async def _answer(self, message: Dict, correlation_id: int):
+        try:
+            response = await self.node.dispatch(message, self)
+        except Exception as e:
+            response = {'type': 'error', 'data': str(e)}
+        if response is None:
+            response = {'type': 'error', 'data': f"No response to {message['type']}"}
+        self.send_frame(encode_frame(response, FLAG_RESPONSE, correlation_id))
+
+    def _disconnected(self):
+        self.connected.clear()
+        if self.writer is not None:
+            self.writer.close()
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Connection to {self.address} lost"))
+        self._pending.clear()
+
+    async def _drain(self):
+        while True:
+            while not self._queue:
+                self._queue_ready.clear()
+                await self._queue_ready.wait()
+            await self.connected.wait()
+            queued_at, frame = self._queue.popleft()
+            try:
+                self.writer.write(frame)
+                await self.writer.drain()
+            except (ConnectionError, OSError):
+                # The read side notices too; outbound links reconnect and
+                # carry on with whatever is still queued.
+                self._disconnected()
+                continue
+            latency = time.monotonic() - queued_at
+            self.last_latency = latency
+            self.average_latency = latency if not self.sent_frames else \
+                0.8 * self.average_latency + 0.2 * latency
+            self.sent_frames += 1
+
+    def send_frame(self, frame: bytes) -> bool:
+        """Queue an encoded frame; returns False if the connection is closed or was reset."""
+        if self._closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            if self.overflow_policy == DISCONNECT:
+                # A peer that can't keep up is cut loose; it resyncs on reconnect.
+                print(f"Send queue to {self.address} is full, disconnecting")
+                self.overflow_disconnects += 1
+                self.dropped_frames += len(self._queue) + 1
+                self._queue.clear()
+                self._disconnected()
+                return False
+            self._queue.popleft()
+            self.dropped_frames += 1
+        self._queue.append((time.monotonic(), frame))
+        self._queue_ready.set()
+        return True
+
+    def send(self, message: Dict, key: Optional[bytes] = None) -> bool:
+        """Queue a message that expects no response."""
+        return self.send_frame(encode_frame(message, key=key))
+
+    async def request(self, message: Dict, timeout: float = 10.0) -> Dict:
+        """Send a request and wait for the response with the same correlation id."""
+        correlation_id = next(self._correlation_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[correlation_id] = future
+        try:
+            if not self.send_frame(encode_frame(message, FLAG_REQUEST, correlation_id)):
+                raise ConnectionError(f"Could not queue request to {self.address}")
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(correlation_id, None)
+        if response['type'] == 'error':
+            raise RemoteError(response['data'])
+        return response
+
+    def stats(self) -> dict:
+        return {
+            'connected': self.connected.is_set(),
+            'queue_depth': len(self._queue),
+            'sent_frames': self.sent_frames,
+            'received_frames': self.received_frames,
+            'dropped_frames': self.dropped_frames,
+            'overflow_disconnects': self.overflow_disconnects,
+            'last_latency': self.last_latency,
+            'average_latency': self.average_latency
+        }
+
+    def close(self):
+        self._closed = True
+        for task in (self._task, self._writer_task):
+            if task is not None:
+                task.cancel()
+        self._queue.clear()
+        self._disconnected()
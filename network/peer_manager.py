@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+UNMEASURED_RTT = 0.5  # assumed for peers we haven't pinged yet, seconds
+
+
+class PeerInfo:
+    def __init__(self, address: tuple):
+        self.address = address
+        self.rtt: Optional[float] = None  # exponentially weighted, seconds
+        self.failures = 0  # consecutive failed pings or requests
+        self.useful = 0  # blocks, ranges and chunks that turned out to be new to us
+        self.misbehavior = 0
+        self.banned_until = 0.0
+        self.last_seen = 0.0  # wall clock of the last successful ping
+
+    def score(self) -> float:
+        """Lower is better: latency, inflated by failures and discounted for useful data."""
+        rtt = self.rtt if self.rtt is not None else UNMEASURED_RTT
+        return rtt * (1 + self.failures) / (1 + min(self.useful, 100) / 20)
+
+    def to_dict(self) -> dict:
+        return {'address': list(self.address), 'rtt': self.rtt, 'last_seen': self.last_seen}
+
+
+class PeerManager:
+    """Chooses which peers the node keeps outbound connections to.
+
+    Addresses are learned from the seed list, from peers' get_addr answers
+    and from peers that ask us for addresses. Connected peers are pinged
+    every interval to measure round-trip time. At most max_outbound of the
+    best scoring peers are kept connected. Peers that keep failing are
+    dropped, and peers that send invalid data are banned for ban_time.
+    node.peers is kept sorted best first, so sync and broadcast favour the
+    fastest peers.
+    """
+
+    def __init__(self, node, max_outbound: int = 8, interval: float = 30.0,
+                 ping_timeout: float = 5.0, max_failures: int = 3, ban_threshold: int = 3,
+                 ban_time: float = 3600.0, max_addresses: int = 1000, path: Optional[str] = None):
+        self.node = node
+        self.max_outbound = max_outbound
+        self.interval = interval
+        self.ping_timeout = ping_timeout
+        self.max_failures = max_failures
+        self.ban_threshold = ban_threshold
+        self.ban_time = ban_time
+        self.max_addresses = max_addresses
+        self.path = path  # where known addresses are kept between runs
+        self.peers: Dict[tuple, PeerInfo] = {}
+        self._task = None
+
+        node.peer_manager = self
+        node.register_handler('get_addr', self.handle_get_addr)
+        if path and os.path.exists(path):
+            self.load()
+        for peer in node.peers:
+            self.add_address(peer)
+
+    def add_address(self, address) -> Optional[PeerInfo]:
+        address = (address[0], int(address[1]))
+        if address == (self.node.host, self.node.port):
+            return None
+        info = self.peers.get(address)
+        if info is None:
+            if len(self.peers) >= self.max_addresses and not self._forget_one():
+                return None
+            info = self.peers[address] = PeerInfo(address)
+        return info
+
+    def _forget_one(self) -> bool:
+        # Make room by dropping the worst address we aren't connected to.
+        candidates = [info for info in self.peers.values() if info.address not in self.node.peers]
+        if not candidates:
+            return False
+        del self.peers[max(candidates, key=PeerInfo.score).address]
+        return True
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                print(f"Peer maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def maintain(self):
+        await asyncio.gather(*(self.ping(peer) for peer in list(self.node.peers)))
+        now = time.time()
+        for peer in list(self.node.peers):
+            info = self.peers.get(peer)
+            if info is not None and info.failures >= self.max_failures:
+                print(f"Dropping unresponsive peer {peer}")
+                self.node.disconnect(peer)
+                # Rested for a while rather than redialled on the next round.
+                info.banned_until = now + 10 * self.interval
+                info.failures = 0
+
+        candidates = sorted((info for info in self.peers.values()
+                             if info.address not in self.node.peers and info.banned_until <= now),
+                            key=PeerInfo.score)
+        while candidates and len(self.node.peers) < self.max_outbound:
+            self.node.add_peer(*candidates.pop(0).address)
+        # When full, try the most promising candidate in place of a peer that
+        # is much slower than the rest, so the set keeps drifting toward
+        # fast peers.
+        if candidates and len(self.node.peers) >= self.max_outbound:
+            worst = max(self.node.peers, key=lambda peer: self.add_address(peer).score())
+            if self.add_address(worst).score() > 2 * self.median_score():
+                self.node.disconnect(worst)
+                self.node.add_peer(*candidates[0].address)
+
+        await self.exchange_addresses()
+        self.rank()
+        if self.path:
+            self.save()
+
+    async def ping(self, peer: tuple):
+        info = self.add_address(peer)
+        if info is None:
+            return
+        start = time.perf_counter()
+        try:
+            await self.node.request(peer, {'type': 'ping', 'data': None}, self.ping_timeout)
+        except Exception:
+            info.failures += 1
+            return
+        rtt = time.perf_counter() - start
+        info.rtt = rtt if info.rtt is None else 0.7 * info.rtt + 0.3 * rtt
+        info.failures = 0
+        info.last_seen = time.time()
+
+    def median_score(self) -> float:
+        scores = sorted(self.add_address(peer).score() for peer in self.node.peers)
+        return scores[len(scores) // 2]
+
+    async def exchange_addresses(self):
+        if not self.node.peers:
+            return
+        peer = random.choice(self.node.peers)
+        try:
+            response = await self.node.request(
+                peer, {'type': 'get_addr', 'data': {'port': self.node.port}}, self.ping_timeout)
+        except Exception:
+            return
+        for address in response['data'][:self.max_addresses]:
+            self.add_address(address)
+
+    async def handle_get_addr(self, data, connection) -> Dict:
+        # The asking peer's listening port tells us where it can be reached.
+        self.add_address((connection.address[0], data['port']))
+        now = time.time()
+        known = sorted((info for info in self.peers.values() if info.banned_until <= now),
+                       key=PeerInfo.score)
+        return {'type': 'addr', 'data': [list(info.address) for info in known[:100]]}
+
+    def rank(self):
+        """Sort node.peers best first."""
+        self.node.peers.sort(key=lambda peer: self.add_address(peer).score())
+
+    def record_useful(self, peer: tuple, amount: int = 1):
+        info = self.peers.get(peer)
+        if info is not None:
+            info.useful += amount
+
+    def record_failure(self, peer: tuple):
+        info = self.peers.get(peer)
+        if info is not None:
+            info.failures += 1
+
+    def record_misbehavior(self, peer: tuple, reason: str):
+        info = self.peers.get(peer)
+        if info is None:
+            return
+        info.misbehavior += 1
+        if info.misbehavior >= self.ban_threshold:
+            print(f"Banning {peer} for {self.ban_time:.0f}s: {reason}")
+            info.banned_until = time.time() + self.ban_time
+            info.misbehavior = 0
+            self.node.disconnect(peer)
+
+    def stats(self) -> List[dict]:
+        return [{'address': peer, 'rtt': self.peers[peer].rtt, 'failures': self.peers[peer].failures,
+                 'useful': self.peers[peer].useful, 'score': self.peers[peer].score()}
+                for peer in self.node.peers if peer in self.peers]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump([info.to_dict() for info in self.peers.values()], f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        with open(self.path, 'r') as f:
+            for entry in json.load(f):
+                info = self.add_address(entry['address'])
+                if info is not None:
+                    info.rtt = entry['rtt']
+                    info.last_seen = entry['last_seen']
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
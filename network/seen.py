@@ -0,0 +1,103 @@
+import hashlib
+import math
+from collections import OrderedDict
+
+
+class RollingBloomFilter:
+    """Bloom filter that remembers roughly the last capacity keys.
+
+    Two generations of capacity / 2 keys each are kept: once the current one
+    is full it becomes the previous one and the oldest generation is
+    dropped, so memory stays fixed while the filter keeps rolling.
+    """
+
+    def __init__(self, capacity: int = 100000, false_positive_rate: float = 0.001):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.generation_size = max(1, capacity // 2)
+        # A key is checked against both generations, so each gets half the budget.
+        rate = false_positive_rate / 2
+        self.bits = max(8, math.ceil(-self.generation_size * math.log(rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bits / self.generation_size * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray((self.bits + 7) // 8)
+        self._current_count = 0
+
+    def _positions(self, key: bytes):
+        # Double hashing: k positions from two 64-bit halves of one digest.
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.bits for i in range(self.hash_count)]
+
+    @staticmethod
+    def _contains(generation: bytearray, positions) -> bool:
+        return all(generation[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __contains__(self, key: bytes) -> bool:
+        positions = self._positions(key)
+        return self._contains(self._current, positions) or self._contains(self._previous, positions)
+
+    def add(self, key: bytes):
+        if self._current_count >= self.generation_size:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._current_count = 0
+        for position in self._positions(key):
+            self._current[position >> 3] |= 1 << (position & 7)
+        self._current_count += 1
+
+
+class SeenCache:
+    """Block hashes and message ids this node has already handled.
+
+    Recent keys are held exactly in an LRU; older ones fall back to a rolling
+    Bloom filter that covers a much longer history in fixed memory. A Bloom
+    false positive drops a genuinely new message, which sync recovers once a
+    later block builds on it.
+    """
+
+    def __init__(self, lru_size: int = 4096, bloom_capacity: int = 100000,
+                 false_positive_rate: float = 0.001):
+        self.lru_size = lru_size
+        self._recent = OrderedDict()
+        self.bloom = RollingBloomFilter(bloom_capacity, false_positive_rate)
+
+        self.lookups = 0
+        self.lru_hits = 0
+        self.bloom_hits = 0
+
+    def seen(self, key: bytes) -> bool:
+        """True if key has been added; a lookup only, except that a hit is refreshed."""
+        self.lookups += 1
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            self.lru_hits += 1
+            return True
+        if key in self.bloom:
+            self.bloom_hits += 1
+            # Refresh it so it doesn't roll out while it's still circulating.
+            self.add(key)
+            return True
+        return False
+
+    def add(self, key: bytes):
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            return
+        self._recent[key] = None
+        self.bloom.add(key)
+        if len(self._recent) > self.lru_size:
+            self._recent.popitem(last=False)
+
+    def stats(self) -> dict:
+        hits = self.lru_hits + self.bloom_hits
+        return {
+            'lookups': self.lookups,
+            'hits': hits,
+            'lru_hits': self.lru_hits,
+            'bloom_hits': self.bloom_hits,
+            'hit_rate': hits / self.lookups if self.lookups else 0.0,
+            'bloom_bits': self.bloom.bits,
+            'bloom_hashes': self.bloom.hash_count
+        }
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from consensus.header import HEADER_PREFIX, HEADER_SIZE
+from consensus.miner import hash_meets_target
+from consensus.validator import check_block
+from network.codec import BLOCK_PREAMBLE
+
+MAX_LOCATOR = 128  # hashes read from a peer's locator; a real one has about 10 + log2(height)
+
+
+class SyncError(Exception):
+    pass
+
+
+class NoCommonTip(Exception):
+    """The peer's chain isn't the one we're following: an honest fork, not bad data."""
+
+
+class ChainSync:
+    """Headers-first catch-up with the best chain among our peers.
+
+    Headers (84 bytes each) are fetched first from the peer with the longest
+    chain. The first request carries a block locator, hashes spaced
+    exponentially back from our tip, and the peer answers from the highest
+    of them it has, so chains that forked still find their common block.
+    Headers come one window of headers_per_request at a time, each checked
+    for linkage and proof of work before the next is asked for. The peer's
+    claimed height is only used to pick it: fetching stops at the first
+    short window, or after max_headers. Bodies are then
+    downloaded in fixed-size ranges from every peer that has them, with
+    several range requests in flight per peer, checked against the header
+    chain and appended in order. A range that fails (timeout, disconnect,
+    bad data) goes back on the queue for another peer, and an interrupted
+    sync resumes from the stored tip next time.
+
+    If the peer's branch forked below our tip and is longer, our blocks
+    past the fork are rolled back, but only once the bodies in hand already
+    reach past our old tip, so a failed sync never leaves us shorter.
+    """
+
+    def __init__(self, node, blockchain, headers_per_request: int = 2000, blocks_per_request: int = 16,
+                 pipeline: int = 4, timeout: float = 30.0, max_headers: int = 100_000):
+        self.node = node
+        self.blockchain = blockchain
+        self.headers_per_request = headers_per_request
+        self.max_headers = max_headers  # per sync; the rest waits for the next one
+        self.blocks_per_request = blocks_per_request
+        self.pipeline = pipeline  # outstanding requests per peer
+        self.timeout = timeout
+        self._lock = asyncio.Lock()
+
+        node.register_handler('sync_request', self.handle_sync_request)
+        node.register_handler('get_headers', self.handle_get_headers)
+        node.register_handler('get_blocks', self.handle_get_blocks)
+
+    # Serving
+
+    def header_at(self, height: int) -> bytes:
+        # The header sits at a fixed offset in the stored record, so it is
+        # read on its own rather than decoding the whole block.
+        record = self.blockchain.store.read(height, 0, BLOCK_PREAMBLE.size + HEADER_SIZE)
+        if record[:1] == b'{':  # stored before the binary codec
+            return self.blockchain.chain[height].serialize_header()
+        return record[BLOCK_PREAMBLE.size:]
+
+    def locator(self) -> List[str]:
+        """Our tip and the nine blocks below it, then every 2nd, 4th, ... block, then genesis."""
+        store = self.blockchain.store
+        hashes, height, step = [], len(store) - 1, 1
+        while height > 0:
+            hashes.append(store.hash_at(height).hex())
+            if len(hashes) >= 10:
+                step *= 2
+            height -= step
+        hashes.append(store.hash_at(0).hex())
+        return hashes
+
+    def fork_point(self, locator: List[str]) -> int:
+        """Height of the highest block in locator that is on our chain."""
+        for block_hash in locator[:MAX_LOCATOR]:
+            height = self.blockchain.store.height_of(bytes.fromhex(block_hash))
+            if height is not None:
+                return height
+        raise ValueError("No block of the locator is on our chain")
+
+    async def handle_sync_request(self, data, connection) -> Dict:
+        chain = self.blockchain.chain
+        return {'type': 'status', 'data': {'height': len(chain), 'tip': chain[-1].hash}}
+
+    async def handle_get_headers(self, data, connection) -> Dict:
+        if 'locator' in data:
+            # The asker may be on a fork: answer from the last block we share.
+            start = self.fork_point(data['locator']) + 1
+        else:
+            start = data['start']
+        if start < 0:
+            raise ValueError(f"Invalid start height {start}")
+        stop = min(start + min(data['count'], self.headers_per_request), len(self.blockchain.chain))
+        headers = [self.header_at(height).hex() for height in range(start, stop)]
+        return {'type': 'headers', 'data': {'start': start, 'headers': headers}}
+
+    async def handle_get_blocks(self, data, connection) -> Dict:
+        start = data['start']
+        if start < 0:
+            raise ValueError(f"Invalid start height {start}")
+        stop = min(start + min(data['count'], self.blocks_per_request), len(self.blockchain.chain))
+        chain = self.blockchain.chain
+        return {'type': 'blocks', 'data': [chain[height] for height in range(start, stop)]}
+
+    # Fetching
+
+    async def peer_heights(self) -> Dict[tuple, int]:
+        async def status(peer):
+            try:
+                response = await self.node.request(peer, {'type': 'sync_request', 'data': None}, self.timeout)
+                return peer, response['data']['height']
+            except Exception as e:
+                print(f"No sync status from {peer}: {e}")
+                return peer, 0
+
+        return dict(await asyncio.gather(*(status(peer) for peer in self.node.peers)))
+
+    async def sync(self) -> int:
+        """Catch up with the longest chain among our peers; returns blocks appended."""
+        async with self._lock:
+            heights = await self.peer_heights()
+            if not heights or max(heights.values()) <= len(self.blockchain.chain):
+                return 0
+            # node.peers is ranked best first, so ties go to the fastest peer.
+            best_peer = max(heights, key=heights.get)
+            try:
+                start, hashes = await self.fetch_headers(best_peer)
+            except NoCommonTip as e:
+                print(f"Not syncing from {best_peer}: {e}")
+                return 0
+            except SyncError as e:
+                self.node.peer_misbehaved(best_peer, str(e))
+                raise
+            if start + len(hashes) <= len(self.blockchain.chain):
+                return 0  # its branch is no longer than ours
+            if start < len(self.blockchain.chain):
+                print(f"{best_peer} has a longer branch from height {start}; switching to it")
+            peers = [peer for peer, height in heights.items() if height > start]
+            return await self.fetch_bodies(peers, heights, start, hashes)
+
+    async def fetch_headers(self, peer: tuple) -> Tuple[int, List[str]]:
+        """Fetch and check peer's headers past our common block; returns (their start, hashes)."""
+        difficulty_bits = self.blockchain.difficulty_bits
+        request = {'locator': self.locator(), 'count': self.headers_per_request}
+        start, previous_hash = None, None
+        hashes = []
+        while len(hashes) < self.max_headers:
+            response = await self.node.request(peer, {'type': 'get_headers', 'data': request},
+                                               self.timeout)
+            headers = response['data']['headers']
+            if len(headers) > self.headers_per_request:
+                raise SyncError(f"{peer} sent {len(headers)} headers for {self.headers_per_request}")
+            if start is None:
+                start = response['data']['start']
+                if not 0 < start <= len(self.blockchain.chain):
+                    raise SyncError(f"{peer} answered our locator from height {start}")
+                previous_hash = bytes.fromhex(self.blockchain.chain[start - 1].hash)
+            for position, header in enumerate(headers):
+                header = bytes.fromhex(header)
+                digest = hashlib.sha256(header).digest()
+                if previous_link(header) != previous_hash:
+                    if position == 0:
+                        # Between requests the peer moved to another branch
+                        # (or never shared the block it answered from).
+                        if not hashes:
+                            raise NoCommonTip(f"its headers do not follow our block {start - 1}")
+                        return start, hashes
+                    raise SyncError(f"Header {len(hashes) + start} from {peer} does not link")
+                if not hash_meets_target(digest, difficulty_bits):
+                    raise SyncError(f"Header {len(hashes) + start} from {peer} misses the target")
+                hashes.append(digest.hex())
+                previous_hash = digest
+            if len(headers) < self.headers_per_request:
+                break  # a short window is the peer's tip
+            request = {'start': start + len(hashes), 'count': self.headers_per_request}
+        return start, hashes
+
+    async def fetch_bodies(self, peers: List[tuple], heights: Dict[tuple, int],
+                           start: int, hashes: List[str]) -> int:
+        stop = start + len(hashes)
+        ranges = deque((begin, min(begin + self.blocks_per_request, stop))
+                       for begin in range(start, stop, self.blocks_per_request))
+        received: Dict[int, List] = {}  # range start -> blocks not yet appended
+        next_height = start
+        failures = {peer: 0 for peer in peers}
+
+        def append_ready():
+            nonlocal next_height
+            if next_height < len(self.blockchain.chain):
+                # Still replacing our own blocks: roll them back only once
+                # the new branch in hand is longer than what we have.
+                end = next_height
+                while end in received:
+                    end += len(received[end])
+                if end <= len(self.blockchain.chain):
+                    return
+                self.blockchain.rollback(next_height)
+            while next_height in received:
+                blocks = received.pop(next_height)
+                if blocks[0].previous_hash != self.blockchain.chain[-1].hash:
+                    # A relayed block moved our tip meanwhile; start over from it.
+                    ranges.clear()
+                    received.clear()
+                    return
+                for block in blocks:
+                    self.blockchain.add_block(block)
+                next_height += len(blocks)
+
+        async def fetch_range(peer, begin, end) -> Optional[List]:
+            response = await self.node.request(
+                peer, {'type': 'get_blocks', 'data': {'start': begin, 'count': end - begin}},
+                self.timeout)
+            blocks = response['data']
+            if len(blocks) != end - begin:
+                raise SyncError(f"{peer} sent {len(blocks)} blocks for {begin}-{end - 1}")
+            for height, block in enumerate(blocks, begin):
+                previous_hash = hashes[height - start - 1] if height > start else \
+                    self.blockchain.chain[start - 1].hash
+                if block.hash != hashes[height - start]:
+                    raise NoCommonTip(f"block {height} from {peer} is on another branch")
+                reason = check_block(block, previous_hash, self.blockchain.difficulty_bits)
+                if reason is not None:
+                    raise SyncError(f"Block {height} from {peer} is invalid: {reason}")
+            return blocks
+
+        async def lane(peer):
+            # One of several concurrent request lanes to a peer.
+            while ranges and failures[peer] < 3:
+                begin, end = ranges.popleft()
+                if heights[peer] < end:
+                    ranges.append((begin, end))  # leave it for a peer that has it
+                    if all(heights[p] < end or failures[p] >= 3 for p in peers):
+                        return
+                    await asyncio.sleep(0)
+                    continue
+                try:
+                    received[begin] = await fetch_range(peer, begin, end)
+                except NoCommonTip as e:
+                    # An honest peer on another branch: just stop asking it.
+                    print(f"Range {begin}-{end - 1} not taken from {peer}: {e}")
+                    failures[peer] = 3
+                    ranges.appendleft((begin, end))
+                    continue
+                except Exception as e:
+                    print(f"Range {begin}-{end - 1} from {peer} failed: {e}")
+                    if isinstance(e, SyncError):
+                        self.node.peer_misbehaved(peer, str(e))
+                    else:
+                        self.node.peer_failed(peer)
+                    failures[peer] += 1
+                    ranges.appendleft((begin, end))
+                    continue
+                self.node.peer_useful(peer, end - begin)
+                append_ready()
+
+        await asyncio.gather(*(lane(peer) for peer in peers for _ in range(self.pipeline)))
+        append_ready()
+        if next_height < stop:
+            print(f"Sync stopped at height {next_height} of {stop}; resuming on the next sync")
+        return next_height - start
+
+
+def previous_link(header: bytes) -> bytes:
+    return HEADER_PREFIX.unpack_from(header)[1]
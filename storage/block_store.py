@@ -0,0 +1,357 @@
+import mmap
+import os
+import struct
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional
+
+# Block payloads live in append-only segment files. Two memory-mapped index
+# files sit next to them:
+#   heights.idx  - fixed-size entries, entry N is the location and hash of
+#                  block N
+#   hashes.idx   - open-addressing hash table, block hash -> height
+# Opening a store only maps the indexes; nothing is replayed.
+
+HEIGHT_INDEX_MAGIC = b'CMHIDX01'
+HASH_INDEX_MAGIC = b'CMHASH01'
+
+INDEX_HEADER = struct.Struct('>8sQ')          # magic, entry count
+HEIGHT_ENTRY = struct.Struct('>IQI32s')       # segment, offset, length, block hash
+HASH_HEADER = struct.Struct('>8sQQ')          # magic, capacity, used
+HASH_SLOT = struct.Struct('>32sQ')            # block hash, height + 1
+RECORD_HEADER = struct.Struct('>I')           # payload length
+
+MIN_HASH_CAPACITY = 1024
+INDEX_GROWTH = 4096
+
+
+class BlockStore:
+    def __init__(self, data_dir: str, segment_size: int = 64 * 1024 * 1024,
+                 sync_every: int = 64, read_only: bool = False):
+        self.data_dir = data_dir
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        # Read-only stores (e.g. in validation workers) see the blocks that
+        # existed when they were opened and never repair or write anything.
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(data_dir, exist_ok=True)
+
+        self._segments = {}  # segment number -> read/append fd
+        self._unsynced = 0
+        self._open_height_index()
+        self._open_hash_index()
+        if not read_only:
+            self._recover_segments()
+
+    def _open_index(self, path: str) -> int:
+        if self.read_only:
+            return os.open(path, os.O_RDONLY)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _map(self, fd: int) -> mmap.mmap:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE)
+
+    # -- height index -----------------------------------------------------
+
+    def _open_height_index(self):
+        path = os.path.join(self.data_dir, 'heights.idx')
+        self._height_fd = self._open_index(path)
+        if os.fstat(self._height_fd).st_size == 0:
+            os.ftruncate(self._height_fd, INDEX_HEADER.size + INDEX_GROWTH * HEIGHT_ENTRY.size)
+            self._height_map = self._map(self._height_fd)
+            INDEX_HEADER.pack_into(self._height_map, 0, HEIGHT_INDEX_MAGIC, 0)
+        else:
+            self._height_map = self._map(self._height_fd)
+        magic, self._count = INDEX_HEADER.unpack_from(self._height_map, 0)
+        if magic != HEIGHT_INDEX_MAGIC:
+            raise ValueError(f"Corrupt height index: {path}")
+
+    def _height_entry(self, height: int):
+        return HEIGHT_ENTRY.unpack_from(
+            self._height_map, INDEX_HEADER.size + height * HEIGHT_ENTRY.size)
+
+    def _write_height_entry(self, height: int, segment: int, offset: int, length: int,
+                            block_hash: bytes):
+        position = INDEX_HEADER.size + height * HEIGHT_ENTRY.size
+        if position + HEIGHT_ENTRY.size > len(self._height_map):
+            self._height_map.flush()
+            self._height_map.close()
+            os.ftruncate(self._height_fd, position + INDEX_GROWTH * HEIGHT_ENTRY.size)
+            self._height_map = mmap.mmap(self._height_fd, 0)
+        HEIGHT_ENTRY.pack_into(self._height_map, position, segment, offset, length, block_hash)
+
+    # -- hash index -------------------------------------------------------
+
+    def _open_hash_index(self):
+        path = os.path.join(self.data_dir, 'hashes.idx')
+        self._hash_fd = self._open_index(path)
+        if os.fstat(self._hash_fd).st_size == 0:
+            self._init_hash_table(self._hash_fd, MIN_HASH_CAPACITY)
+        self._hash_map = self._map(self._hash_fd)
+        magic, self._hash_capacity, self._hash_used = HASH_HEADER.unpack_from(self._hash_map, 0)
+        if magic != HASH_INDEX_MAGIC:
+            raise ValueError(f"Corrupt hash index: {path}")
+
+    @staticmethod
+    def _init_hash_table(fd: int, capacity: int):
+        os.ftruncate(fd, HASH_HEADER.size + capacity * HASH_SLOT.size)
+        os.pwrite(fd, HASH_HEADER.pack(HASH_INDEX_MAGIC, capacity, 0), 0)
+
+    @staticmethod
+    def _probe(table, capacity: int, block_hash: bytes) -> int:
+        # Block hashes are uniformly distributed, so their leading bytes
+        # make a good slot number without rehashing.
+        slot = int.from_bytes(block_hash[:8], 'big') & (capacity - 1)
+        while True:
+            position = HASH_HEADER.size + slot * HASH_SLOT.size
+            stored_hash, stored_height = HASH_SLOT.unpack_from(table, position)
+            if stored_height == 0 or stored_hash == block_hash:
+                return position
+            slot = (slot + 1) & (capacity - 1)
+
+    def _insert_hash(self, block_hash: bytes, height: int):
+        if (self._hash_used + 1) * 2 > self._hash_capacity:
+            self._grow_hash_index()
+        position = self._probe(self._hash_map, self._hash_capacity, block_hash)
+        if HASH_SLOT.unpack_from(self._hash_map, position)[1] == 0:
+            self._hash_used += 1
+            HASH_HEADER.pack_into(self._hash_map, 0, HASH_INDEX_MAGIC,
+                                  self._hash_capacity, self._hash_used)
+        HASH_SLOT.pack_into(self._hash_map, position, block_hash, height + 1)
+
+    def _grow_hash_index(self):
+        # Rehash the existing slots into a table twice the size, then swap it
+        # in atomically. Only the index is touched, never the segments.
+        capacity = self._hash_capacity * 2
+        path = os.path.join(self.data_dir, 'hashes.idx')
+        tmp_path = path + '.tmp'
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._init_hash_table(fd, capacity)
+        table = mmap.mmap(fd, 0)
+        for slot in range(self._hash_capacity):
+            block_hash, stored_height = HASH_SLOT.unpack_from(
+                self._hash_map, HASH_HEADER.size + slot * HASH_SLOT.size)
+            if stored_height:
+                HASH_SLOT.pack_into(table, self._probe(table, capacity, block_hash),
+                                    block_hash, stored_height)
+        HASH_HEADER.pack_into(table, 0, HASH_INDEX_MAGIC, capacity, self._hash_used)
+        table.flush()
+        os.fsync(fd)
+
+        self._hash_map.close()
+        os.close(self._hash_fd)
+        os.replace(tmp_path, path)
+        self._hash_fd = fd
+        self._hash_map = table
+        self._hash_capacity = capacity
+
+    # -- segments ---------------------------------------------------------
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.data_dir, f'segment_{segment:05d}.dat')
+
+    def _segment_fd(self, segment: int) -> int:
+        fd = self._segments.get(segment)
+        if fd is None:
+            if self.read_only:
+                fd = os.open(self._segment_path(segment), os.O_RDONLY)
+            else:
+                fd = os.open(self._segment_path(segment), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            self._segments[segment] = fd
+        return fd
+
+    def _recover_segments(self):
+        # The index count is only advanced after the payload is written, so
+        # anything past the last indexed record is a torn append: drop it.
+        # The index pages may also reach disk ahead of the segment after a
+        # power loss, so forget entries whose payload never made it.
+        while self._count:
+            segment, offset, length, _ = self._height_entry(self._count - 1)
+            path = self._segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= offset + length:
+                break
+            self._count -= 1
+            INDEX_HEADER.pack_into(self._height_map, 0, HEIGHT_INDEX_MAGIC, self._count)
+
+        if self._count == 0:
+            self._segment, self._segment_end = 0, 0
+            if os.path.exists(self._segment_path(0)):
+                os.truncate(self._segment_path(0), 0)
+            return
+        # Any of the blocks appended since the last flush may have lost its
+        # hash slot, not just the tip: walk back until a flush interval's
+        # worth of blocks in a row are all indexed.
+        indexed_run, height = 0, self._count - 1
+        while height >= 0 and indexed_run < self.sync_every:
+            block_hash = self._height_entry(height)[3]
+            if self.height_of(block_hash) is None:
+                self._insert_hash(block_hash, height)
+                indexed_run = 0
+            else:
+                indexed_run += 1
+            height -= 1
+        segment, offset, length, _ = self._height_entry(self._count - 1)
+        self._segment, self._segment_end = segment, offset + length
+        if os.path.getsize(self._segment_path(segment)) > self._segment_end:
+            os.truncate(self._segment_path(segment), self._segment_end)
+        stale = segment + 1
+        while os.path.exists(self._segment_path(stale)):
+            os.remove(self._segment_path(stale))
+            stale += 1
+
+    # -- public API -------------------------------------------------------
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, block_hash: bytes, payload: bytes) -> int:
+        """Append a serialized block and return its height."""
+        if self.read_only:
+            raise ValueError("Block store was opened read-only")
+        if self._segment_end and self._segment_end + RECORD_HEADER.size + len(payload) > self.segment_size:
+            self.flush()
+            self._segment, self._segment_end = self._segment + 1, 0
+
+        fd = self._segment_fd(self._segment)
+        os.write(fd, RECORD_HEADER.pack(len(payload)) + payload)
+        offset = self._segment_end + RECORD_HEADER.size
+        self._segment_end = offset + len(payload)
+
+        height = self._count
+        self._write_height_entry(height, self._segment, offset, len(payload), block_hash)
+        self._count += 1
+        INDEX_HEADER.pack_into(self._height_map, 0, HEIGHT_INDEX_MAGIC, self._count)
+        self._insert_hash(block_hash, height)
+
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.flush()
+        return height
+
+    def truncate(self, height: int):
+        """Drop the blocks at height and above, e.g. to switch to a longer branch.
+
+        The index count goes down (and to disk) before the segments shrink,
+        so a crash in between only leaves a tail that recovery drops anyway.
+        Hash slots of dropped blocks stay behind; height_of ignores them.
+        """
+        if self.read_only:
+            raise ValueError("Block store was opened read-only")
+        if not 0 < height <= self._count:
+            raise IndexError("block height out of range")
+        if height == self._count:
+            return
+        self.flush()
+        self._count = height
+        INDEX_HEADER.pack_into(self._height_map, 0, HEIGHT_INDEX_MAGIC, self._count)
+        self._height_map.flush()
+
+        segment, offset, length, _ = self._height_entry(height - 1)
+        stale = segment + 1
+        while os.path.exists(self._segment_path(stale)):
+            fd = self._segments.pop(stale, None)
+            if fd is not None:
+                os.close(fd)
+            os.remove(self._segment_path(stale))
+            stale += 1
+        self._segment, self._segment_end = segment, offset + length
+        os.truncate(self._segment_path(segment), self._segment_end)
+
+    def get(self, height: int) -> bytes:
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("block height out of range")
+        segment, offset, length, _ = self._height_entry(height)
+        return os.pread(self._segment_fd(segment), length, offset)
+
+    def read(self, height: int, start: int, length: int) -> bytes:
+        """Up to length bytes of the block at height, from start within its payload."""
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("block height out of range")
+        segment, offset, record_length, _ = self._height_entry(height)
+        length = max(0, min(length, record_length - start))
+        return os.pread(self._segment_fd(segment), length, offset + start)
+
+    def height_of(self, block_hash: bytes) -> Optional[int]:
+        position = self._probe(self._hash_map, self._hash_capacity, block_hash)
+        stored_height = HASH_SLOT.unpack_from(self._hash_map, position)[1] - 1
+        # A slot can outlive its block if an append was torn after the hash
+        # was indexed; the height entry is authoritative.
+        if 0 <= stored_height < self._count and self.hash_at(stored_height) == block_hash:
+            return stored_height
+        return None
+
+    def hash_at(self, height: int) -> bytes:
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("block height out of range")
+        return self._height_entry(height)[3]
+
+    def get_by_hash(self, block_hash: bytes) -> Optional[bytes]:
+        height = self.height_of(block_hash)
+        return None if height is None else self.get(height)
+
+    def flush(self):
+        """Make every appended block durable: segment data first, then indexes."""
+        if self.read_only:
+            return
+        if self._segment in self._segments:
+            os.fsync(self._segments[self._segment])
+        self._hash_map.flush()
+        self._height_map.flush()
+        self._unsynced = 0
+
+    def close(self):
+        self.flush()
+        self._height_map.close()
+        self._hash_map.close()
+        os.close(self._height_fd)
+        os.close(self._hash_fd)
+        for fd in self._segments.values():
+            os.close(fd)
+        self._segments.clear()
+
+
+class BlockSequence:
+    """Read-only, list-like view of a BlockStore that decodes blocks on access."""
+
+    def __init__(self, store: BlockStore, decode: Callable[[bytes], object], cache_size: int = 128):
+        self.store = store
+        self.decode = decode
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # height -> decoded block
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self[i] for i in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self.store)
+        block = self._cache.get(height)
+        if block is None:
+            block = self.decode(self.store.get(height))
+            self.remember(height, block)
+        else:
+            self._cache.move_to_end(height)
+        return block
+
+    def __iter__(self) -> Iterator:
+        for height in range(len(self.store)):
+            yield self[height]
+
+    def forget(self, height: int):
+        """Drop cached blocks at height and above, after the store was truncated."""
+        for cached in [h for h in self._cache if h >= height]:
+            del self._cache[cached]
+
+    def remember(self, height: int, block):
+        self._cache[height] = block
+        self._cache.move_to_end(height)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+
+class RecipientIndex:
+    """Maps recipient addresses to the (height, position) of their chunks.
+
+    Rows get an increasing sequence number as blocks are indexed, so a
+    per-wallet cursor is just the last sequence number handed out.
+
+    Like the block store, writes are committed every sync_every blocks (or
+    on flush); attach() re-indexes whatever a crash left uncommitted.
+    """
+
+    def __init__(self, db_path: str = "recipients.db", sync_every: int = 64):
+        self.db_path = db_path
+        self.sync_every = sync_every
+        self.cursors: Dict[str, int] = {}  # wallet_address -> last seen seq
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')  # durable at checkpoints, safe in WAL
+        self.init_db()
+
+    def init_db(self):
+        c = self.conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_locations
+            (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+             recipient_address TEXT, height INTEGER, position INTEGER)
+        ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS chunk_locations_by_recipient
+            ON chunk_locations (recipient_address, seq)
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS index_state
+            (key TEXT PRIMARY KEY, value INTEGER)
+        ''')
+        self.conn.commit()
+
+    @property
+    def indexed_height(self) -> int:
+        row = self.conn.execute(
+            "SELECT value FROM index_state WHERE key = 'indexed_height'").fetchone()
+        return row[0] if row else -1
+
+    def add_block(self, height: int, block):
+        rows = [(chunk.recipient_address, height, position)
+                for position, chunk in enumerate(block.email_chunks)]
+        with self._lock:
+            c = self.conn.cursor()
+            c.executemany('INSERT INTO chunk_locations (recipient_address, height, position) '
+                          'VALUES (?, ?, ?)', rows)
+            c.execute("INSERT OR REPLACE INTO index_state VALUES ('indexed_height', ?)", (height,))
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._commit()
+
+    def rollback(self, height: int, blocks=None):
+        """Forget the blocks from height up; committed at once, unlike appends.
+
+        A rollback left uncommitted would leave rows for the old blocks at
+        heights attach() believes are already indexed.
+        """
+        with self._lock:
+            c = self.conn.cursor()
+            c.execute('DELETE FROM chunk_locations WHERE height >= ?', (height,))
+            c.execute("INSERT OR REPLACE INTO index_state VALUES ('indexed_height', ?)", (height - 1,))
+            self._commit()
+
+    def _commit(self):
+        self.conn.commit()
+        self._unsynced = 0
+
+    def flush(self):
+        """Commit every indexed block."""
+        with self._lock:
+            self._commit()
+
+    def attach(self, blockchain):
+        """Index whatever the chain gained since the last run, then follow appends."""
+        self.sync_every = blockchain.store.sync_every
+        if self.indexed_height >= len(blockchain.chain):
+            # Blocks that were indexed but never made it to disk.
+            self.rollback(len(blockchain.chain))
+        for height in range(self.indexed_height + 1, len(blockchain.chain)):
+            self.add_block(height, blockchain.chain[height])
+        self.flush()
+        blockchain.subscribe(self.add_block)
+        blockchain.subscribe_rollback(self.rollback)
+
+    def locations(self, wallet_address: str, after_seq: int = 0) -> List[Tuple[int, int, int]]:
+        """All (seq, height, position) rows for wallet_address past after_seq."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT seq, height, position FROM chunk_locations '
+                'WHERE recipient_address = ? AND seq > ? ORDER BY seq',
+                (wallet_address, after_seq)).fetchall()
+
+    def poll(self, wallet_address: str) -> List[Tuple[int, int]]:
+        """(height, position) of chunks added for wallet_address since the last poll."""
+        rows = self.locations(wallet_address, self.cursors.get(wallet_address, 0))
+        if rows:
+            self.cursors[wallet_address] = rows[-1][0]
+        return [(height, position) for _, height, position in rows]
+
+    def reset_cursor(self, wallet_address: str):
+        self.cursors.pop(wallet_address, None)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
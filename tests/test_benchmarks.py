@@ -0,0 +1,32 @@
+"""Smoke tests: every benchmark imports and runs end to end with tiny arguments."""
+from benchmarks import cluster_benchmark
+from benchmarks import header_hash_benchmark
+from benchmarks import stake_selection_benchmark
+from benchmarks import wallet_resolver_benchmark
+from benchmarks import wire_codec_benchmark
+
+
+def test_header_hash_benchmark(capsys):
+    header_hash_benchmark.main(['--chunks', '4', '--chunk-size', '64', '--seconds', '0.05'])
+    assert capsys.readouterr().out
+
+
+def test_wire_codec_benchmark(capsys):
+    wire_codec_benchmark.main(['--chunks', '4', '--chunk-size', '256', '--seconds', '0.05'])
+    assert 'binary' in capsys.readouterr().out
+
+
+def test_wallet_resolver_benchmark(capsys):
+    wallet_resolver_benchmark.main(['--wallets', '200', '--threads', '1', '--seconds', '0.05', '--hot', '10'])
+    assert 'get_key' in capsys.readouterr().out
+
+
+def test_stake_selection_benchmark(capsys):
+    stake_selection_benchmark.main(['--stakers', '1000', '--seconds', '0.05'])
+    assert 'fenwick' in capsys.readouterr().out
+
+
+def test_cluster_benchmark(capsys):
+    cluster_benchmark.main(['--nodes', '2', '--rate', '2', '--size', '256', '--duration', '1',
+                            '--settle', '1', '--difficulty', '4', '--base-port', '19700'])
+    assert 'chain tips' in capsys.readouterr().out
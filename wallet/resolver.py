@@ -1,34 +1,186 @@
 import sqlite3
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from crypto.keys import load_public_key
+
+# Statements are kept as constants so sqlite3's per-connection statement
+# cache prepares each of them once.
+INSERT_WALLET = 'INSERT OR REPLACE INTO wallet_mappings VALUES (?, ?)'
+SELECT_KEY = 'SELECT public_key FROM wallet_mappings WHERE wallet_address = ?'
+IN_BATCH = 500  # addresses per IN query, well under SQLite's variable limit
+
 
 class WalletResolver:
-    def __init__(self, db_path: str = "wallets.db"):
+    """Wallet address -> public key store in SQLite.
+
+    Each thread gets its own long-lived connection in WAL mode, so lookups
+    from the SMTP and handler threads don't pay for a connect per call and
+    readers never wait on a writer.
+
+    get_key() serves parsed public keys from an LRU, and remembers unknown
+    addresses for negative_ttl seconds, so repeat sends skip both SQLite and
+    key parsing. Registering a wallet invalidates both caches for it.
+    """
+
+    def __init__(self, db_path: str = "wallets.db", key_cache_size: int = 4096,
+                 negative_cache_size: int = 4096, negative_ttl: float = 30.0):
         self.db_path = db_path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        self.key_cache_size = key_cache_size
+        self.negative_cache_size = negative_cache_size
+        self.negative_ttl = negative_ttl
+        self._keys = OrderedDict()  # wallet_address -> parsed public key
+        self._unknown = OrderedDict()  # wallet_address -> monotonic expiry
+        self._cache_lock = threading.Lock()
+        # Bumped by every invalidate, so a lookup that raced a registration
+        # can tell its database read may predate it.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
         self.init_db()
 
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=64,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # durable at checkpoints, safe in WAL
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-16384')  # 16 MiB page cache
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('''
+        conn = self._connection()
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS wallet_mappings
             (wallet_address TEXT PRIMARY KEY, public_key BLOB)
         ''')
         conn.commit()
-        conn.close()
 
     def register_wallet(self, wallet_address: str, public_key: bytes):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('INSERT OR REPLACE INTO wallet_mappings VALUES (?, ?)',
-                 (wallet_address, public_key))
-        conn.commit()
-        conn.close()
+        conn = self._connection()
+        with conn:
+            conn.execute(INSERT_WALLET, (wallet_address, public_key))
+        self.invalidate([wallet_address])
+
+    def register_many(self, wallets: Iterable[Tuple[str, bytes]]):
+        """Register (wallet_address, public_key) pairs in one transaction."""
+        wallets = list(wallets)
+        conn = self._connection()
+        with conn:
+            conn.executemany(INSERT_WALLET, wallets)
+        self.invalidate(address for address, _ in wallets)
+
+    def invalidate(self, wallet_addresses: Iterable[str]):
+        with self._cache_lock:
+            self._generation += 1
+            for address in wallet_addresses:
+                self._keys.pop(address, None)
+                self._unknown.pop(address, None)
 
     def get_public_key(self, wallet_address: str) -> Optional[bytes]:
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute('SELECT public_key FROM wallet_mappings WHERE wallet_address = ?',
-                 (wallet_address,))
-        result = c.fetchone()
-        conn.close()
-        return result[0] if result else None
\ No newline at end of file
+        result = self._connection().execute(SELECT_KEY, (wallet_address,)).fetchone()
+        return result[0] if result else None
+
+    def get_many(self, wallet_addresses: Iterable[str]) -> Dict[str, bytes]:
+        """Public keys of the given addresses; unknown addresses are left out."""
+        addresses = list(dict.fromkeys(wallet_addresses))
+        conn = self._connection()
+        keys = {}
+        for start in range(0, len(addresses), IN_BATCH):
+            batch = addresses[start:start + IN_BATCH]
+            # Full batches share one query text, so they share one prepared statement.
+            query = ('SELECT wallet_address, public_key FROM wallet_mappings '
+                     f'WHERE wallet_address IN ({",".join("?" * len(batch))})')
+            keys.update(conn.execute(query, batch).fetchall())
+        return keys
+
+    def _cached(self, wallet_address: str, now: float):
+        """(found, key) from the caches; key is None for a known-unknown address."""
+        key = self._keys.get(wallet_address)
+        if key is not None:
+            self._keys.move_to_end(wallet_address)
+            self.hits += 1
+            return True, key
+        expiry = self._unknown.get(wallet_address)
+        if expiry is not None:
+            if expiry > now:
+                self.negative_hits += 1
+                return True, None
+            del self._unknown[wallet_address]
+        self.misses += 1
+        return False, None
+
+    def _remember(self, found: Dict[str, object], unknown: Iterable[str], now: float,
+                  generation: int):
+        with self._cache_lock:
+            if generation != self._generation:
+                # A wallet was registered since the lookup read the database:
+                # caching what it saw could hide that wallet for negative_ttl.
+                return
+            for address, key in found.items():
+                self._keys[address] = key
+                self._keys.move_to_end(address)
+            for address in unknown:
+                self._unknown[address] = now + self.negative_ttl
+                self._unknown.move_to_end(address)
+            while len(self._keys) > self.key_cache_size:
+                self._keys.popitem(last=False)
+            while len(self._unknown) > self.negative_cache_size:
+                self._unknown.popitem(last=False)
+
+    def get_key(self, wallet_address: str):
+        """Parsed public key of wallet_address, or None if it isn't registered."""
+        return self.get_keys([wallet_address]).get(wallet_address)
+
+    def get_keys(self, wallet_addresses: Iterable[str]) -> Dict[str, object]:
+        """Parsed public keys of the given addresses; unknown addresses are left out."""
+        now = time.monotonic()
+        keys, pending = {}, []
+        with self._cache_lock:
+            generation = self._generation
+            for address in dict.fromkeys(wallet_addresses):
+                found, key = self._cached(address, now)
+                if key is not None:
+                    keys[address] = key
+                elif not found:
+                    pending.append(address)
+        if pending:
+            # Parsing happens outside the lock; a racing thread may parse the
+            # same key, which is harmless.
+            loaded = {address: load_public_key(key_data)
+                      for address, key_data in self.get_many(pending).items()}
+            self._remember(loaded, (address for address in pending if address not in loaded), now,
+                           generation)
+            keys.update(loaded)
+        return keys
+
+    def cache_stats(self) -> dict:
+        with self._cache_lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                'cached_keys': len(self._keys),
+                'cached_unknown': len(self._unknown)
+            }
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()